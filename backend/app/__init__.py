@@ -1,5 +1,12 @@
 from flask import Flask
 from .models import db, User
+from .allocator import rebuild_allocators
+from .geo import rebuild_lot_grid
+from .config import CELERY_BEAT_SCHEDULE
+from .migrations import upgrade
+from .commands import register_commands
+from .occupancy_series import start_sampler
+from .lot_events import configure_events
 import os
 from dotenv import load_dotenv
 from flask_jwt_extended import JWTManager
@@ -20,7 +27,7 @@ celery = Celery(
     'app',
     backend='redis://localhost:6379/0',
     broker='redis://localhost:6379/0',
-    include=['app.tasks.exports', 'app.tasks.reminders', 'app.tasks.reports']
+    include=['app.tasks.exports', 'app.tasks.reminders', 'app.tasks.reports', 'app.tasks.occupancy']
 )
 
 # Configuring celery
@@ -33,6 +40,9 @@ celery.conf.update(
     worker_pool='solo',  
     worker_concurrency=1,  
     task_always_eager=False,  
+    # Only the occupancy reconcile runs on beat; the email jobs in config.py
+    # are not scheduled from here
+    beat_schedule={'reconcile-lot-occupancy': CELERY_BEAT_SCHEDULE['reconcile-lot-occupancy']},
 )
 
 
@@ -48,7 +58,7 @@ def make_celery(app):
     return celery
 
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
 
     CORS(app, resources={r"/api/*": {"origins": ["http://localhost:8080", "http://127.0.0.1:8080"]}}, supports_credentials=True)
@@ -71,6 +81,26 @@ def create_app():
     app.config['JWT_TOKEN_LOCATION'] = ['headers']              
     app.config['JWT_COOKIE_CSRF_PROTECT'] = False              
 
+    # Response cache: CACHE_BACKEND=lru (per process), redis (shared) or null
+    from .view_cache import CACHE_BACKENDS
+    app.config['CACHE_TYPE'] = CACHE_BACKENDS[os.environ.get('CACHE_BACKEND', 'lru')]
+    app.config['CACHE_DEFAULT_TIMEOUT'] = 60
+    app.config['CACHE_THRESHOLD'] = int(os.environ.get('CACHE_THRESHOLD', 2048))
+    app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/1')
+    app.config['CACHE_KEY_PREFIX'] = 'parking:'
+
+    # Live lot events: EVENTS_BACKEND=local (per process) or redis (all workers)
+    app.config['EVENTS_BACKEND'] = os.environ.get('EVENTS_BACKEND', 'local')
+    app.config['EVENTS_REDIS_URL'] = os.environ.get('EVENTS_REDIS_URL', 'redis://localhost:6379/2')
+
+    # Web-process state (allocators, lot grid, hold expiry); Celery tasks and
+    # other helpers that only need the database turn this off
+    app.config['WARM_WEB_STATE'] = True
+
+    # Overrides for scripts that need their own database (e.g. benchmarks)
+    if test_config:
+        app.config.update(test_config)
+
     try:
         os.makedirs(app.instance_path, exist_ok=True)
     except OSError:
@@ -79,6 +109,7 @@ def create_app():
     db.init_app(app)
     jwt = JWTManager(app)
     cache.init_app(app)
+    configure_events(app)
     app.celery = make_celery(app)
 
     app.config['PROPAGATE_EXCEPTIONS'] = True
@@ -94,6 +125,8 @@ def create_app():
     # Creating admin (default user)
     with app.app_context():
         db.create_all()
+        # Bringing existing databases up to the current schema
+        upgrade()
         admin = User.query.filter_by(role='admin').first()
         if not admin:
             admin = User(
@@ -110,6 +143,15 @@ def create_app():
             db.session.add(admin)
             db.session.commit()
 
+        if app.config['WARM_WEB_STATE']:
+            # Loading free spots into the in-memory allocators
+            rebuild_allocators()
+            # Indexing lot coordinates for nearest-lot lookups
+            rebuild_lot_grid()
+            # Scheduling expiry of holds that are still active
+            from .holds import load_active_holds
+            load_active_holds(app)
+
     # Registering blueprints
     from .api.auth import auth_bp
     from .api.admin import admin_bp
@@ -117,8 +159,15 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(admin_bp)
     app.register_blueprint(user_bp)
+    register_commands(app)
+
+    # Occupancy sampling runs in the process that serves requests, not in
+    # Celery workers or CLI commands that also build the app
+    @app.before_request
+    def start_background_samplers():
+        start_sampler(app)
 
-    from .tasks import exports, reminders, reports
+    from .tasks import exports, reminders, reports, occupancy
 
     @app.errorhandler(500)
     def handle_500(e):
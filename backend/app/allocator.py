@@ -0,0 +1,240 @@
+from array import array
+import threading
+from sqlalchemy import update
+from .models import db, ParkingSpot
+
+# Process-local free-spot allocator, one per parking lot.
+#
+# Each lot keeps a bitmap of free spots (one byte per spot_number) and a
+# free-list stack of spot numbers, so finding and claiming a free spot is O(1)
+# instead of a query over parking_spots. The parking_spots table stays the
+# source of truth: claim_spot()/claim_spots() flip the row with a conditional
+# UPDATE, so two workers can never take the same spot.
+
+# How many allocator picks claim_spot() tries before asking the database
+MAX_CLAIM_ATTEMPTS = 8
+
+
+class LotAllocator:
+    def __init__(self, lot_id):
+        self.lot_id = lot_id
+        self._lock = threading.Lock()
+        self._spot_ids = array('q')   # spot_number -> spot id (0 = no spot)
+        self._free = bytearray()      # spot_number -> 1 if free
+        self._stack = array('I')      # free spot numbers, lowest on top
+        self._free_count = 0
+
+    def load(self, spots):
+        """Rebuild from (spot_id, spot_number, status) rows."""
+        spots = list(spots)
+        size = max((number for _, number, _ in spots), default=0) + 1
+        spot_ids = array('q', bytes(8 * size))
+        free = bytearray(size)
+        for spot_id, number, status in spots:
+            spot_ids[number] = spot_id
+            if status == 'A':
+                free[number] = 1
+        stack = array('I', (n for n in range(size - 1, 0, -1) if free[n]))
+        with self._lock:
+            self._spot_ids = spot_ids
+            self._free = free
+            self._stack = stack
+            self._free_count = len(stack)
+
+    @property
+    def free_count(self):
+        return self._free_count
+
+    def claim(self):
+        """Pop the lowest free spot, returning (spot_id, spot_number) or None."""
+        with self._lock:
+            while self._stack:
+                number = self._stack.pop()
+                # Entries discarded while on the stack are skipped lazily
+                if self._free[number]:
+                    self._free[number] = 0
+                    self._free_count -= 1
+                    return self._spot_ids[number], number
+            return None
+
+    def release(self, spot_number, spot_id=None):
+        with self._lock:
+            if spot_number >= len(self._free):
+                grow = spot_number + 1 - len(self._free)
+                self._free.extend(bytes(grow))
+                self._spot_ids.extend([0] * grow)
+            if spot_id is not None:
+                self._spot_ids[spot_number] = spot_id
+            if not self._spot_ids[spot_number] or self._free[spot_number]:
+                return
+            self._free[spot_number] = 1
+            self._free_count += 1
+            self._stack.append(spot_number)
+
+    def discard(self, spot_number):
+        """Mark a spot as not free without touching the stack."""
+        with self._lock:
+            if spot_number < len(self._free) and self._free[spot_number]:
+                self._free[spot_number] = 0
+                self._free_count -= 1
+
+
+_allocators = {}
+_registry_lock = threading.Lock()
+
+
+def _spot_rows(lot_id=None):
+    query = db.session.query(
+        ParkingSpot.lot_id, ParkingSpot.id, ParkingSpot.spot_number, ParkingSpot.status
+    )
+    if lot_id is not None:
+        query = query.filter(ParkingSpot.lot_id == lot_id)
+    return query.all()
+
+
+def rebuild_allocators():
+    """Rebuild every lot's allocator from parking_spots in one query."""
+    by_lot = {}
+    for lot_id, spot_id, number, status in _spot_rows():
+        by_lot.setdefault(lot_id, []).append((spot_id, number, status))
+    allocators = {}
+    for lot_id, spots in by_lot.items():
+        allocator = LotAllocator(lot_id)
+        allocator.load(spots)
+        allocators[lot_id] = allocator
+    with _registry_lock:
+        _allocators.clear()
+        _allocators.update(allocators)
+
+
+def rebuild_allocator(lot_id):
+    allocator = LotAllocator(lot_id)
+    allocator.load((spot_id, number, status) for _, spot_id, number, status in _spot_rows(lot_id))
+    with _registry_lock:
+        _allocators[lot_id] = allocator
+    return allocator
+
+
+def get_allocator(lot_id):
+    allocator = _allocators.get(lot_id)
+    if allocator is None:
+        loaded = LotAllocator(lot_id)
+        loaded.load((spot_id, number, status) for _, spot_id, number, status in _spot_rows(lot_id))
+        # Concurrent first requests must all share one allocator, or they
+        # hand out the same spot numbers
+        with _registry_lock:
+            allocator = _allocators.setdefault(lot_id, loaded)
+    return allocator
+
+
+def drop_allocator(lot_id):
+    with _registry_lock:
+        _allocators.pop(lot_id, None)
+
+
+def _has_free_spot(lot_id):
+    # Answered from ix_parking_spots_lot_status, however big the lot
+    return db.session.query(db.session.query(ParkingSpot.id).filter(
+        ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A'
+    ).exists()).scalar()
+
+
+def _claim_from_db(lot_id, count, status='O'):
+    """Claim up to `count` spots the database reports free, bypassing the allocator.
+
+    Used once the allocator keeps losing races; only stops short of `count`
+    when the database has no free spot left in the lot.
+    """
+    allocator = get_allocator(lot_id)
+    claimed = []
+    while len(claimed) < count:
+        candidates = dict(db.session.query(ParkingSpot.id, ParkingSpot.spot_number).filter(
+            ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A'
+        ).limit(count - len(claimed)).all())
+        if not candidates:
+            break
+        won = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(candidates), ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+            .values(status=status, is_occupied=True)
+            .returning(ParkingSpot.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        for spot_id in won:
+            allocator.discard(candidates[spot_id])
+            claimed.append((spot_id, candidates[spot_id]))
+    return claimed
+
+
+def claim_spot(lot_id, status='O'):
+    """Atomically mark a free spot of the lot occupied (or held, with status='H').
+
+    Returns (spot_id, spot_number), or None only when the database has no
+    free spot in the lot. The caller owns the transaction
+    and must hand the spot back with get_allocator(lot_id).release() if it
+    rolls back.
+    """
+    allocator = get_allocator(lot_id)
+    rebuilt = False
+    attempts = 0
+    while attempts < MAX_CLAIM_ATTEMPTS:
+        claimed = allocator.claim()
+        if not claimed:
+            # Allocator may be stale (e.g. spots freed by another worker), but
+            # only reload the lot when the database has a spot it missed
+            if rebuilt or not _has_free_spot(lot_id):
+                return None
+            allocator = rebuild_allocator(lot_id)
+            rebuilt = True
+            continue
+        spot_id, spot_number = claimed
+        attempts += 1
+        result = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id == spot_id, ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+            .values(status=status, is_occupied=True)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            return spot_id, spot_number
+    # Lost every race; the database decides whether the lot is really full
+    claimed = _claim_from_db(lot_id, 1, status)
+    return claimed[0] if claimed else None
+
+
+def claim_spots(lot_id, count):
+    """Atomically claim up to `count` free spots of the lot in bulk.
+
+    Returns a list of (spot_id, spot_number), which is shorter than `count`
+    only when the database has no more free spots in the lot. Same transaction rules as
+    claim_spot().
+    """
+    allocator = get_allocator(lot_id)
+    claimed = []
+    rebuilt = False
+    rounds = 0
+    while len(claimed) < count and rounds < MAX_CLAIM_ATTEMPTS:
+        candidates = {}
+        while len(claimed) + len(candidates) < count:
+            spot = allocator.claim()
+            if not spot:
+                break
+            candidates[spot[0]] = spot[1]
+        if not candidates:
+            if rebuilt or not _has_free_spot(lot_id):
+                break
+            allocator = rebuild_allocator(lot_id)
+            rebuilt = True
+            continue
+        rounds += 1
+        won = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(candidates), ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+            .values(status='O', is_occupied=True)
+            .returning(ParkingSpot.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        claimed.extend((spot_id, candidates[spot_id]) for spot_id in won)
+    if len(claimed) < count and rounds >= MAX_CLAIM_ATTEMPTS:
+        claimed.extend(_claim_from_db(lot_id, count - len(claimed)))
+    return claimed
@@ -1,13 +1,29 @@
 from flask import Blueprint, request, jsonify, make_response, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import ParkingLot, ParkingSpot, Reservation, User, db
-from datetime import datetime, timedelta
+from app.models import ParkingLot, ParkingSpot, Reservation, User, LotHourlyRollup, LotDailyRollup, db
+from datetime import date, datetime, timedelta
 import pytz
-from sqlalchemy import func, extract
+from sqlalchemy import func
 from collections import defaultdict
 import traceback
+import time
 import os
+import json
 from app.tasks.exports import export_users_csv
+from app.allocator import drop_allocator
+from app.geo import grid, index_lot, parse_coordinates
+from app.view_cache import cache_stats, invalidate_lot_views
+from app.spot_map import compact_spot_map, wants_compact
+from app.provisioning import add_spots, resize_lot, spots_per_floor
+from app.checkout import active_reservations_query, complete_reservations, after_checkout
+from app.pricing import parse_rate, parse_tariff, parking_cost
+from app.rollups import record_completions, delete_lot_rollups
+from app.user_stats import record_user_completions, rebuild_user_stats
+from app import occupancy_series
+from app.lot_summary import lot_summaries
+from app.search import search_ids, search_limit, MAX_SEARCH_LIMIT
+from app.pagination import page_size, keyset_page, keyset_chunks, decode_cursor, sorted_page
+from app.streaming import stream_format, stream_records
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
@@ -41,21 +57,22 @@ def admin_required(fn):
 @admin_required
 def get_parking_lots():
     try:
-        lots = ParkingLot.query.all()
         lots_data = []
         
-        for lot in lots:
-            # Counting occupied spots
-            occupied_count = ParkingSpot.query.filter_by(lot_id=lot.id, status='O').count()
-            
+        for lot, occupied, available in lot_summaries():
             lots_data.append({
                 'id': lot.id,
                 'name': lot.prime_location_name,
                 'price_per_hour': lot.price,
                 'address': lot.address,
                 'pin_code': lot.pin_code,
+                'latitude': lot.latitude,
+                'longitude': lot.longitude,
                 'total_spots': lot.number_of_spots,
-                'occupied': occupied_count,
+                'floors': lot.floors,
+                'tariff': json.loads(lot.tariff) if lot.tariff else None,
+                'occupied': occupied,
+                'available': available,
                 'created_at': lot.created_at.isoformat() if lot.created_at else None
             })
         
@@ -68,27 +85,36 @@ def get_parking_lots():
 def create_parking_lot():
     try:
         data = request.get_json()
+        number_of_spots = int(data.get('number_of_spots', 0))
+        floors = int(data.get('floors', 1))
+        if number_of_spots < 0 or floors < 1:
+            return jsonify({'error': 'Invalid number of spots or floors'}), 400
+        try:
+            price = parse_rate(data.get('price', 0), 'price')
+            tariff = parse_tariff(data.get('tariff'))
+            latitude, longitude = parse_coordinates(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         lot = ParkingLot(
             prime_location_name=data.get('prime_location_name', ''),
-            price=data.get('price', 0),
+            price=price,
+            tariff=tariff,
             address=data.get('address', ''),
             pin_code=data.get('pin_code', ''),
-            number_of_spots=data.get('number_of_spots', 0)
+            latitude=latitude,
+            longitude=longitude,
+            number_of_spots=number_of_spots,
+            floors=floors
         )
         db.session.add(lot)
-        db.session.commit()
+        db.session.flush()
 
-        # Creating spots for the lot
-        for i in range(1, lot.number_of_spots + 1):
-            spot = ParkingSpot(
-                lot_id=lot.id,
-                spot_number=i,
-                status='A',
-                is_occupied=False,
-                floor=1  
-            )
-            db.session.add(spot)
+        # Creating spots for the lot, spread evenly over its floors
+        add_spots(lot.id, 1, number_of_spots, spots_per_floor(number_of_spots, floors))
         db.session.commit()
+        drop_allocator(lot.id)
+        index_lot(lot)
+        invalidate_lot_views(lot.id)
 
         return jsonify({'message': 'Parking lot created successfully', 'id': lot.id}), 201
     except Exception as e:
@@ -102,11 +128,29 @@ def update_parking_lot(lot_id):
         lot = ParkingLot.query.get_or_404(lot_id)
         data = request.get_json()
         lot.prime_location_name = data.get('prime_location_name', lot.prime_location_name)
-        lot.price = data.get('price', lot.price)
         lot.address = data.get('address', lot.address)
         lot.pin_code = data.get('pin_code', lot.pin_code)
-        lot.number_of_spots = data.get('number_of_spots', lot.number_of_spots)
+        try:
+            if 'price' in data:
+                lot.price = parse_rate(data['price'], 'price')
+            if 'tariff' in data:
+                lot.tariff = parse_tariff(data['tariff'])
+            lot.latitude, lot.longitude = parse_coordinates(data, lot.latitude, lot.longitude)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        number_of_spots = int(data.get('number_of_spots', lot.number_of_spots))
+        floors = int(data.get('floors', lot.floors or 1))
+        if number_of_spots < 0 or floors < 1:
+            return jsonify({'error': 'Invalid number of spots or floors'}), 400
+        # Adding or removing spot rows to match the new size
+        if not resize_lot(lot, number_of_spots, floors):
+            db.session.rollback()
+            return jsonify({'error': 'Cannot remove occupied spots. Release them before shrinking the lot'}), 400
         db.session.commit()
+        drop_allocator(lot_id)
+        index_lot(lot)
+        invalidate_lot_views(lot_id)
         return jsonify({'message': 'Parking lot updated successfully'})
     except Exception as e:
         db.session.rollback()
@@ -120,8 +164,19 @@ def delete_parking_lot(lot_id):
         if lot.occupied > 0:
             return jsonify({'error': 'Cannot delete parking lot with active reservations'}), 400
         
+        # Their reservations are deleted with the lot, so their statistics change
+        user_ids = [row[0] for row in db.session.query(Reservation.user_id).filter(
+            Reservation.parking_lot_id == lot_id
+        ).distinct().all()]
         db.session.delete(lot)
+        db.session.flush()
+        delete_lot_rollups(lot_id)
+        rebuild_user_stats(user_ids)
         db.session.commit()
+        drop_allocator(lot_id)
+        grid.remove(lot_id)
+        occupancy_series.discard_lot_series(lot_id)
+        invalidate_lot_views(lot_id)
         return jsonify({'message': 'Parking lot deleted successfully'})
     except Exception as e:
         db.session.rollback()
@@ -138,7 +193,11 @@ def view_parking_lot(lot_id):
             'price_per_hour': lot.price,
             'address': lot.address,
             'pin_code': lot.pin_code,
+            'latitude': lot.latitude,
+            'longitude': lot.longitude,
             'total_spots': lot.number_of_spots,
+            'floors': lot.floors,
+            'tariff': json.loads(lot.tariff) if lot.tariff else None,
             'occupied': lot.occupied,
             'created_at': lot.created_at.isoformat() if lot.created_at else None
         })
@@ -148,9 +207,26 @@ def view_parking_lot(lot_id):
 @admin_bp.route('/parking-lots/<int:lot_id>/details', methods=['GET'])
 @admin_required
 def view_parking_lot_details(lot_id):
+    """Lot with its spots; ?format=compact sends a run-length spot map instead"""
     try:
         lot = ParkingLot.query.get_or_404(lot_id)
-        spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
+        if wants_compact(request):
+            spot_map = compact_spot_map(lot_id)
+            occupied_count = spot_map['counts'].get('O', 0)
+            return jsonify({
+                'id': lot.id,
+                'name': lot.prime_location_name,
+                'address': lot.address,
+                'pin_code': lot.pin_code,
+                'total_spots': lot.number_of_spots,
+                'price_per_hour': lot.price,
+                'occupied': occupied_count,
+                'available_spots': spot_map['counts'].get('A', 0),
+                'occupied_spots': occupied_count,
+                'version': lot.spot_version,
+                'spot_map': spot_map
+            })
+        spots = ParkingSpot.query.filter_by(lot_id=lot_id).order_by(ParkingSpot.spot_number).all()
         spots_data = [{
             'id': spot.id,
             'spot_number': spot.spot_number,
@@ -180,7 +256,7 @@ def view_parking_lot_details(lot_id):
 @admin_required
 def get_parking_spots(lot_id):
     try:
-        spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
+        spots = ParkingSpot.query.filter_by(lot_id=lot_id).order_by(ParkingSpot.spot_number).all()
         return jsonify([{
             'id': spot.id,
             'spot_number': spot.spot_number,
@@ -226,7 +302,7 @@ def get_spot_details(spot_id):
                 duration_hours = (current_time - reservation.parking_timestamp).total_seconds() / 3600
                 lot = ParkingLot.query.get(reservation.parking_lot_id)
                 if lot:
-                    current_cost = round(duration_hours * lot.price, 2)
+                    _, current_cost = parking_cost(reservation.parking_timestamp, current_time, lot.price, lot.tariff)
                     print(f"Cost calculation: duration={duration_hours}h, lot_price={lot.price}, cost={current_cost}")
                 else:
                     print(f"Lot not found for lot_id: {reservation.parking_lot_id}")
@@ -260,44 +336,147 @@ def get_spot_details(spot_id):
         print(f"Traceback: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/reservations/release-batch', methods=['POST'])
+@admin_required
+def release_batch():
+    try:
+        data = request.get_json() or {}
+        reservation_ids = data.get('reservation_ids')
+        lot_id = data.get('lot_id')
+        if reservation_ids is not None and (
+            not isinstance(reservation_ids, list)
+            or not all(isinstance(rid, int) and not isinstance(rid, bool) for rid in reservation_ids)
+        ):
+            return jsonify({'error': 'reservation_ids must be a list of integer ids'}), 400
+        if reservation_ids:
+            rows = active_reservations_query(Reservation.id.in_(reservation_ids)).all()
+        elif lot_id:
+            rows = active_reservations_query(Reservation.parking_lot_id == lot_id).all()
+        else:
+            return jsonify({'error': 'reservation_ids or lot_id is required'}), 400
+
+        ist = pytz.timezone('Asia/Kolkata')
+        leaving_time = datetime.now(ist).replace(tzinfo=None)
+        completed = complete_reservations(rows, leaving_time)
+        db.session.commit()
+        after_checkout(completed)
+
+        released_ids = {item['id'] for item in completed}
+        return jsonify({
+            'message': f'{len(completed)} reservations released',
+            'released': len(completed),
+            'total_cost': round(sum(item['cost'] for item in completed), 2),
+            'skipped': [rid for rid in (reservation_ids or []) if rid not in released_ids],
+            'reservations': [{
+                'id': item['id'],
+                'lot_id': item['lot_id'],
+                'spot_number': item['spot_number'],
+                'duration_hours': round(item['duration_hours'], 2),
+                'cost': item['cost'],
+                'leaving_timestamp': item['leaving_timestamp'].isoformat()
+            } for item in completed]
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def _user_totals():
+    """Correlated per-user reservation count and spend, evaluated only for the rows served."""
+    count = db.session.query(func.count(Reservation.id)).filter(
+        Reservation.user_id == User.id
+    ).correlate(User).scalar_subquery()
+    spend = db.session.query(func.coalesce(func.sum(Reservation.parking_cost), 0.0)).filter(
+        Reservation.user_id == User.id
+    ).correlate(User).scalar_subquery()
+    return count, spend
+
+
 @admin_bp.route('/users', methods=['GET'])
 @admin_required
 def get_users():
+    """Paginated user directory with reservation count and total spend.
+
+    Query params: limit, cursor, sort (id, username, created_at, reservations,
+    spend) and order (asc/desc).
+    """
     try:
-        users = User.query.all()
-        return jsonify([{
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'phone_number': user.phone_number,
-            'role': user.role
-        } for user in users])
+        limit = page_size(request.args.get('limit'))
+        count, spend = _user_totals()
+        sorts = {
+            'id': (User.id, 'id', int),
+            'username': (User.username, 'username', None),
+            'created_at': (User.created_at, 'created_at', datetime.fromisoformat),
+            'reservations': (count, 'reservation_count', int),
+            'spend': (spend, 'total_spent', float),
+        }
+        sort = request.args.get('sort', 'id')
+        if sort not in sorts:
+            return jsonify({'error': f"sort must be one of {', '.join(sorts)}"}), 400
+        order = request.args.get('order', 'asc').lower()
+        if order not in ('asc', 'desc'):
+            return jsonify({'error': 'order must be asc or desc'}), 400
+        sort_column, sort_key, parse = sorts[sort]
+
+        query = db.session.query(
+            User.id, User.username, User.email, User.first_name, User.last_name,
+            User.phone_number, User.role, User.flagged, User.created_at,
+            count.label('reservation_count'), spend.label('total_spent')
+        )
+        rows, next_cursor = sorted_page(query, sort_column, sort_key, User.id, request.args.get('cursor'),
+                                        limit, descending=order == 'desc', parse=parse)
+        return jsonify({
+            'users': [{
+                'id': u.id,
+                'username': u.username,
+                'email': u.email,
+                'first_name': u.first_name,
+                'last_name': u.last_name,
+                'phone_number': u.phone_number,
+                'role': u.role,
+                'flagged': bool(u.flagged),
+                'created_at': u.created_at.isoformat() if u.created_at else None,
+                'reservation_count': u.reservation_count,
+                'total_spent': round(u.total_spent or 0, 2)
+            } for u in rows],
+            'total': db.session.query(func.count(User.id)).scalar(),
+            'next_cursor': next_cursor
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @admin_bp.route('/users/<int:user_id>/details', methods=['GET'])
 @admin_required
 def get_user_details(user_id):
+    """User profile plus one page of their reservations (limit, cursor)."""
     try:
         user = User.query.get_or_404(user_id)
-        # Fetch all reservations for this user
-        reservations = Reservation.query.filter_by(user_id=user.id).order_by(Reservation.parking_timestamp.desc()).all()
-        reservations_list = []
-        for r in reservations:
-            lot = ParkingLot.query.get(r.parking_lot_id)
-            spot = ParkingSpot.query.get(r.spot_id)
-            reservations_list.append({
-                'id': r.id,
-                'lot_name': lot.prime_location_name if lot else 'Unknown',
-                'spot_number': spot.spot_number if spot else 'Unknown',
-                'vehicle_number': r.vehicle_number,
-                'parking_timestamp': r.parking_timestamp.isoformat() if r.parking_timestamp else None,
-                'leaving_timestamp': r.leaving_timestamp.isoformat() if r.leaving_timestamp else None,
-                'cost': r.parking_cost,
-                'status': r.status
-            })
+        limit = page_size(request.args.get('limit'))
+        query = db.session.query(
+            Reservation.id,
+            Reservation.vehicle_number,
+            Reservation.parking_timestamp,
+            Reservation.leaving_timestamp,
+            Reservation.parking_cost,
+            Reservation.status,
+            ParkingLot.prime_location_name,
+            ParkingSpot.spot_number
+        ).outerjoin(ParkingLot, ParkingLot.id == Reservation.parking_lot_id
+        ).outerjoin(ParkingSpot, ParkingSpot.id == Reservation.spot_id
+        ).filter(Reservation.user_id == user.id)
+        rows, next_cursor = keyset_page(query, Reservation.parking_timestamp, Reservation.id,
+                                        request.args.get('cursor'), limit)
+        reservations_list = [{
+            'id': r.id,
+            'lot_name': r.prime_location_name if r.prime_location_name is not None else 'Unknown',
+            'spot_number': r.spot_number if r.spot_number is not None else 'Unknown',
+            'vehicle_number': r.vehicle_number,
+            'parking_timestamp': r.parking_timestamp.isoformat() if r.parking_timestamp else None,
+            'leaving_timestamp': r.leaving_timestamp.isoformat() if r.leaving_timestamp else None,
+            'cost': r.parking_cost,
+            'status': r.status
+        } for r in rows]
         return jsonify({
             'id': user.id,
             'username': user.username,
@@ -310,8 +489,11 @@ def get_user_details(user_id):
             'address': user.address,
             'created_at': user.created_at.isoformat() if user.created_at else None,
             'flagged': getattr(user, 'flagged', False),
-            'reservations': reservations_list
+            'reservations': reservations_list,
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -347,22 +529,25 @@ def unflag_user(user_id):
 @admin_required
 def get_analytics_summary():
     try:
-        # Get total revenue from completed reservations
-        total_revenue = db.session.query(func.sum(Reservation.parking_cost)).filter(
-            Reservation.leaving_timestamp.isnot(None)
-        ).scalar() or 0
+        # Completed totals from the daily rollups
+        completed_reservations, total_revenue = db.session.query(
+            func.coalesce(func.sum(LotDailyRollup.completed), 0),
+            func.coalesce(func.sum(LotDailyRollup.revenue), 0.0)
+        ).one()
         
-        # Get total reservations
-        total_reservations = Reservation.query.count()
-        
-        # Get active reservations 
-        active_reservations = Reservation.query.filter_by(leaving_timestamp=None).count()
+        # Get active reservations. Grouping by lot (as lot_summary does) makes
+        # SQLite walk the partial index on open reservations; a bare count
+        # would scan a full index instead
+        open_per_lot = db.session.query(func.count(Reservation.id).label('active')).filter(
+            Reservation.leaving_timestamp.is_(None)
+        ).group_by(Reservation.parking_lot_id).subquery()
+        active_reservations = db.session.query(func.coalesce(func.sum(open_per_lot.c.active), 0)).scalar()
         
-        # Get completed reservations 
-        completed_reservations = Reservation.query.filter(Reservation.leaving_timestamp.isnot(None)).count()
+        # Get total reservations
+        total_reservations = completed_reservations + active_reservations
         
         # Get total occupied spots 
-        occupied_spots = ParkingSpot.query.filter_by(status='O').count()
+        occupied_spots = db.session.query(func.sum(ParkingLot.occupied)).scalar() or 0
         
         return jsonify({
             'total_revenue': float(total_revenue),
@@ -383,17 +568,16 @@ def get_analytics_monthly():
         # Get current year
         current_year = datetime.now().year
         
-        # Get monthly data for current year (only completed reservations for cost)
+        # Get monthly data for current year from the daily rollups (bucketed by parking date)
+        month = func.strftime('%m', LotDailyRollup.bucket)
         monthly_data = db.session.query(
-            extract('month', Reservation.parking_timestamp).label('month'),
-            func.count(Reservation.id).label('count'),
-            func.sum(Reservation.parking_cost).label('cost')
+            month.label('month'),
+            func.sum(LotDailyRollup.completed).label('count'),
+            func.sum(LotDailyRollup.revenue).label('cost')
         ).filter(
-            extract('year', Reservation.parking_timestamp) == current_year,
-            Reservation.leaving_timestamp.isnot(None)  
-        ).group_by(
-            extract('month', Reservation.parking_timestamp)
-        ).all()
+            LotDailyRollup.bucket >= date(current_year, 1, 1),
+            LotDailyRollup.bucket < date(current_year + 1, 1, 1)
+        ).group_by(month).all()
         
         # dictionary format
         result = {}
@@ -408,26 +592,107 @@ def get_analytics_monthly():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/analytics/hourly', methods=['GET'])
+@admin_required
+def get_analytics_hourly():
+    """Completed reservations, revenue and occupied hours per parking hour.
+
+    Query params: hours (default 24, at most 24 * 31) and lot_id.
+    """
+    try:
+        hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 31)
+        ist = pytz.timezone('Asia/Kolkata')
+        now = datetime.now(ist).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+        start = now - timedelta(hours=hours - 1)
+        query = db.session.query(
+            LotHourlyRollup.bucket,
+            func.sum(LotHourlyRollup.completed),
+            func.sum(LotHourlyRollup.revenue),
+            func.sum(LotHourlyRollup.occupied_hours)
+        ).filter(LotHourlyRollup.bucket >= start)
+        lot_id = request.args.get('lot_id', type=int)
+        if lot_id is not None:
+            query = query.filter(LotHourlyRollup.lot_id == lot_id)
+        totals = {bucket: (count, revenue, occupied) for bucket, count, revenue, occupied in
+                  query.group_by(LotHourlyRollup.bucket).all()}
+        result = []
+        for i in range(hours):
+            bucket = start + timedelta(hours=i)
+            count, revenue, occupied = totals.get(bucket, (0, 0.0, 0.0))
+            result.append({
+                'hour': bucket.isoformat(),
+                'count': count,
+                'revenue': round(revenue, 2),
+                'occupied_hours': round(occupied, 2)
+            })
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/analytics/occupancy', methods=['GET'])
+@admin_required
+def get_analytics_occupancy():
+    """Sampled occupancy per lot, downsampled to at most `points` buckets.
+
+    Query params: lot_id (default all lots), from and to (ISO, IST; default
+    the last `hours`, 24 unless given) and points (default 120).
+    """
+    try:
+        store = occupancy_series.store
+        if store is None:
+            return jsonify({'error': 'Occupancy sampling is disabled'}), 503
+        ist = pytz.timezone('Asia/Kolkata')
+        if request.args.get('to'):
+            end = ist.localize(datetime.fromisoformat(request.args['to'])).timestamp()
+        else:
+            end = time.time()
+        if request.args.get('from'):
+            start = ist.localize(datetime.fromisoformat(request.args['from'])).timestamp()
+        else:
+            start = end - request.args.get('hours', 24, type=float) * 3600
+        if start > end:
+            return jsonify({'error': 'from must be before to'}), 400
+        points = min(max(request.args.get('points', 120, type=int), 1), 1000)
+
+        lot_query = db.session.query(ParkingLot.id, ParkingLot.prime_location_name, ParkingLot.number_of_spots)
+        lot_id = request.args.get('lot_id', type=int)
+        if lot_id is not None:
+            lot_query = lot_query.filter(ParkingLot.id == lot_id)
+        series = []
+        bucket_seconds = store.interval
+        for lot in lot_query.order_by(ParkingLot.id).all():
+            bucket_seconds, buckets = store.series(lot.id, start, end, points)
+            series.append({
+                'lot_id': lot.id,
+                'name': lot.prime_location_name,
+                'total_spots': lot.number_of_spots,
+                'points': [{
+                    'time': datetime.fromtimestamp(at, ist).replace(tzinfo=None).isoformat(),
+                    'occupied': mean,
+                    'max_occupied': peak
+                } for at, mean, peak in buckets]
+            })
+        return jsonify({'sample_seconds': store.interval, 'bucket_seconds': bucket_seconds, 'series': series})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @admin_bp.route('/analytics/lot', methods=['GET'])
 @admin_required
 def get_analytics_lot():
     try:
         # Get lot performance data
-        lots = ParkingLot.query.all()
         result = []
         
-        for lot in lots:
-            # Get actual occupied spots count for this lot
-            occupied_count = ParkingSpot.query.filter_by(lot_id=lot.id, status='O').count()
-            
-            # Get reservations for this lot
-            reservations = Reservation.query.filter_by(parking_lot_id=lot.id).count()
-            
+        for row in lot_summaries(with_reservations=True):
+            lot, occupied_count = row.ParkingLot, row.occupied
             result.append({
                 'name': lot.prime_location_name,
                 'occupied': occupied_count,
                 'total_spots': lot.number_of_spots,
-                'reservations': reservations,
+                'reservations': row.reservations,
+                'revenue': round(row.revenue, 2),
                 'utilization_rate': (occupied_count / lot.number_of_spots * 100) if lot.number_of_spots > 0 else 0
             })
         
@@ -453,6 +718,7 @@ def generate_test_data():
             return jsonify({'error': 'Need parking lots and users to generate test data'}), 400
         
         # Generate reservations for the last 6 months
+        completions = []
         for i in range(30):  # 30 sample reservations
             lot = random.choice(lots)
             user = random.choice(users)
@@ -472,7 +738,7 @@ def generate_test_data():
             end_time = start_time + timedelta(hours=duration_hours)
             
             # Calculate cost
-            cost = lot.price * duration_hours
+            _, cost = parking_cost(start_time, end_time, lot.price, lot.tariff)
             
             # Random status (most completed, some active)
             status = 'Completed' if random.random() > 0.2 else 'Active'
@@ -490,36 +756,105 @@ def generate_test_data():
             )
             
             db.session.add(reservation)
+            if status == 'Completed':
+                completions.append({'lot_id': lot.id, 'user_id': user.id, 'parking_timestamp': start_time,
+                                    'duration_hours': duration_hours, 'cost': cost})
         
+        record_completions(completions)
+        record_user_completions(completions)
         db.session.commit()
         return jsonify({'message': 'Test data generated successfully'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _parking_records_query(args):
+    """Reservations joined with their user, lot and spot, filtered by request args."""
+    query = db.session.query(
+        Reservation.id,
+        Reservation.vehicle_number,
+        Reservation.parking_timestamp,
+        Reservation.leaving_timestamp,
+        Reservation.parking_cost,
+        Reservation.status,
+        User.first_name,
+        User.last_name,
+        ParkingLot.prime_location_name,
+        ParkingSpot.spot_number
+    ).outerjoin(User, User.id == Reservation.user_id
+    ).outerjoin(ParkingLot, ParkingLot.id == Reservation.parking_lot_id
+    ).outerjoin(ParkingSpot, ParkingSpot.id == Reservation.spot_id)
+
+    lot_id = args.get('lot_id', type=int)
+    if lot_id is not None:
+        query = query.filter(Reservation.parking_lot_id == lot_id)
+    status = (args.get('status') or '').lower()
+    if status == 'active':
+        query = query.filter(Reservation.leaving_timestamp.is_(None))
+    elif status == 'completed':
+        query = query.filter(Reservation.leaving_timestamp.isnot(None))
+    elif status:
+        raise ValueError('status must be active or completed')
+    if args.get('from'):
+        query = query.filter(Reservation.parking_timestamp >= datetime.fromisoformat(args['from']))
+    if args.get('to'):
+        to = datetime.fromisoformat(args['to'])
+        if len(args['to']) == 10:
+            # A bare date includes the whole day
+            to += timedelta(days=1)
+            query = query.filter(Reservation.parking_timestamp < to)
+        else:
+            query = query.filter(Reservation.parking_timestamp <= to)
+    return query
+
+
+STREAM_CHUNK_SIZE = 1000
+PARKING_RECORD_COLUMNS = ['id', 'user_name', 'lot_name', 'spot_number', 'vehicle_number', 'parking_timestamp',
+                          'leaving_timestamp', 'duration_hours', 'cost', 'status']
+
+
+def _parking_record(r):
+    return {
+        'id': r.id,
+        'user_name': f"{r.first_name} {r.last_name}" if r.first_name is not None else 'Unknown',
+        'lot_name': r.prime_location_name if r.prime_location_name is not None else 'Unknown',
+        'spot_number': r.spot_number if r.spot_number is not None else 'Unknown',
+        'vehicle_number': r.vehicle_number,
+        'parking_timestamp': r.parking_timestamp.isoformat() if r.parking_timestamp else None,
+        'leaving_timestamp': r.leaving_timestamp.isoformat() if r.leaving_timestamp else None,
+        'duration_hours': round(((r.leaving_timestamp - r.parking_timestamp).total_seconds() / 3600), 2) if r.leaving_timestamp else None,
+        'cost': r.parking_cost,
+        'status': r.status
+    }
+
+
 @admin_bp.route('/parking-records', methods=['GET'])
 @admin_required
 def get_parking_records():
+    """One page of parking records, newest first.
+
+    Query params: limit, cursor (next_cursor of the previous page), lot_id,
+    status (active/completed), from and to (ISO dates on parking time).
+    With Accept: application/x-ndjson or text/csv every matching record after
+    the cursor is streamed instead, and limit is ignored.
+    """
     try:
-        records = []
-        reservations = Reservation.query.order_by(Reservation.parking_timestamp.desc()).all()
-        for r in reservations:
-            user = User.query.get(r.user_id)
-            lot = ParkingLot.query.get(r.parking_lot_id)
-            spot = ParkingSpot.query.get(r.spot_id)
-            records.append({
-                'id': r.id,
-                'user_name': f"{user.first_name} {user.last_name}" if user else 'Unknown',
-                'lot_name': lot.prime_location_name if lot else 'Unknown',
-                'spot_number': spot.spot_number if spot else 'Unknown',
-                'vehicle_number': r.vehicle_number,
-                'parking_timestamp': r.parking_timestamp.isoformat() if r.parking_timestamp else None,
-                'leaving_timestamp': r.leaving_timestamp.isoformat() if r.leaving_timestamp else None,
-                'duration_hours': round(((r.leaving_timestamp - r.parking_timestamp).total_seconds() / 3600), 2) if r.leaving_timestamp else None,
-                'cost': r.parking_cost,
-                'status': r.status
-            })
-        return jsonify({'records': records})
+        query = _parking_records_query(request.args)
+        fmt = stream_format(request)
+        if fmt:
+            cursor = request.args.get('cursor')
+            if cursor:
+                decode_cursor(cursor)
+            rows = keyset_chunks(query, Reservation.parking_timestamp, Reservation.id,
+                                 cursor, STREAM_CHUNK_SIZE)
+            return stream_records((_parking_record(r) for r in rows), fmt,
+                                  PARKING_RECORD_COLUMNS, 'parking_records')
+        limit = page_size(request.args.get('limit'))
+        rows, next_cursor = keyset_page(query, Reservation.parking_timestamp, Reservation.id,
+                                        request.args.get('cursor'), limit)
+        return jsonify({'records': [_parking_record(r) for r in rows], 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -587,112 +922,90 @@ def download_exported_csv(task_id):
 @admin_bp.route('/search/parking-lots', methods=['GET'])
 @admin_required
 def search_parking_lots():
+    """Prefix search over lot name, address and pin code, best matches first (q, limit)."""
     try:
         query = request.args.get('q', '').strip()
-        print(f"=== PARKING LOTS SEARCH DEBUG ===")
-        print(f"Query: '{query}'")
-        
         if not query:
-            print("Empty query, returning empty array")
             return jsonify([])
         
-        # Checking what parking lots exist in the DB
-        all_lots = ParkingLot.query.all()
-        print(f"Total parking lots in DB: {len(all_lots)}")
-        for lot in all_lots:
-            print(f"Lot ID: {lot.id}, prime_location_name: '{lot.prime_location_name}', name: '{getattr(lot, 'name', 'N/A')}'")
-        
-        # Search functionality
-        lots = ParkingLot.query.filter(
-            db.or_(
-                ParkingLot.prime_location_name.ilike(f'%{query}%'),
-                ParkingLot.address.ilike(f'%{query}%'),
-                ParkingLot.pin_code.ilike(f'%{query}%')
-            )
-        ).all()
-        
-        print(f"Search results count: {len(lots)}")
-        for lot in lots:
-            print(f"Found lot: ID={lot.id}, name='{lot.prime_location_name}'")
+        ids = search_ids(db.session, 'lots_fts', query, search_limit(request.args.get('limit')))
+        rank = {lot_id: i for i, lot_id in enumerate(ids)}
+        lots = sorted(lot_summaries(ParkingLot.id.in_(ids)), key=lambda row: rank[row[0].id]) if ids else []
         
         lots_data = []
-        for lot in lots:
-            occupied_count = ParkingSpot.query.filter_by(lot_id=lot.id, is_occupied=True).count()
-            lot_data = {
+        for lot, occupied, available in lots:
+            lots_data.append({
                 'id': lot.id,
                 'name': lot.prime_location_name,
                 'price_per_hour': lot.price,
                 'address': lot.address,
                 'pin_code': lot.pin_code,
                 'total_spots': lot.number_of_spots,
-                'occupied': occupied_count,
+                'occupied': occupied,
+                'available': available,
                 'created_at': lot.created_at.isoformat() if lot.created_at else None
-            }
-            lots_data.append(lot_data)
-            print(f"Added lot data: {lot_data}")
-        
-        print(f"Returning {len(lots_data)} results")
+            })
         return jsonify(lots_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Search error: {str(e)}")
-        import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 @admin_bp.route('/search/parking-spots', methods=['GET'])
 @admin_required
 def search_parking_spots():
+    """Spots by status and by spot number or lot name/address prefix (q, limit)."""
     try:
         status = request.args.get('status', '').strip().lower()
         query = request.args.get('q', '').strip()
-        spots_query = ParkingSpot.query
+        limit = search_limit(request.args.get('limit'))
+        spots_query = db.session.query(
+            ParkingSpot, ParkingLot.prime_location_name, ParkingLot.address
+        ).outerjoin(ParkingLot, ParkingLot.id == ParkingSpot.lot_id)
         if status:
             if status == 'available':
                 spots_query = spots_query.filter(ParkingSpot.is_occupied == False)
             elif status == 'occupied':
                 spots_query = spots_query.filter(ParkingSpot.is_occupied == True)
         if query:
-            spots_query = spots_query.join(ParkingLot).filter(
-                db.or_(
-                    ParkingSpot.spot_number.ilike(f'%{query}%'),
-                    ParkingLot.prime_location_name.ilike(f'%{query}%'),
-                    ParkingLot.address.ilike(f'%{query}%')
-                )
-            )
-        spots = spots_query.all()
+            if query.isdigit():
+                spots_query = spots_query.filter(ParkingSpot.spot_number == int(query))
+            else:
+                # Spots of the best matching lots
+                lot_ids = search_ids(db.session, 'lots_fts', query, MAX_SEARCH_LIMIT)
+                spots_query = spots_query.filter(ParkingSpot.lot_id.in_(lot_ids))
+        spots = spots_query.order_by(ParkingSpot.lot_id, ParkingSpot.spot_number).limit(limit).all()
         spots_data = []
-        for spot in spots:
-            lot = ParkingLot.query.get(spot.lot_id)
+        for spot, lot_name, lot_address in spots:
             spots_data.append({
                 'id': spot.id,
                 'spot_number': spot.spot_number,
                 'status': spot.status,
                 'is_occupied': spot.is_occupied,
                 'floor': spot.floor,
-                'lot_name': lot.prime_location_name if lot else 'Unknown',
-                'lot_address': lot.address if lot else 'Unknown',
+                'lot_name': lot_name if lot_name is not None else 'Unknown',
+                'lot_address': lot_address if lot_address is not None else 'Unknown',
                 'lot_id': spot.lot_id
             })
         return jsonify(spots_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @admin_bp.route('/search/users', methods=['GET'])
 @admin_required
 def search_users():
+    """Prefix search over username, email, phone and names, best matches first (q, limit)."""
     try:
         query = request.args.get('q', '').strip()
         if not query:
             return jsonify([])
-        users = User.query.filter(
-            db.or_(
-                User.username.ilike(f'%{query}%'),
-                User.email.ilike(f'%{query}%'),
-                User.phone_number.ilike(f'%{query}%'),
-                User.first_name.ilike(f'%{query}%'),
-                User.last_name.ilike(f'%{query}%')
-            )
-        ).all()
+        ids = search_ids(db.session, 'users_fts', query, search_limit(request.args.get('limit')))
+        rank = {user_id: i for i, user_id in enumerate(ids)}
+        users = sorted(User.query.filter(User.id.in_(ids)).all(), key=lambda u: rank[u.id]) if ids else []
         users_data = []
         for user in users:
             users_data.append({
@@ -707,6 +1020,8 @@ def search_users():
                 'created_at': user.created_at.isoformat() if user.created_at else None
             })
         return jsonify(users_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -736,3 +1051,12 @@ def debug_data():
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/cache/stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    """Response cache hit/miss counters of the worker serving this request"""
+    try:
+        return jsonify(cache_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,19 +1,36 @@
-from flask import Blueprint, request, jsonify, make_response
+from flask import Blueprint, request, jsonify, make_response, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import db, User, ParkingLot, ParkingSpot, Reservation
+from app.models import db, User, ParkingLot, ParkingSpot, Reservation, SpotHold
 from datetime import datetime
+from sqlalchemy import update
+import hashlib
 import math
 import pytz
 import traceback
-from app import cache
+from app.view_cache import cached_view
+from app.allocator import get_allocator, claim_spot, claim_spots
+from app.checkout import active_reservations_query, complete_reservations, after_checkout, invalidate_lot_views
+from app.occupancy import adjust_occupied
+from app.idempotency import idempotent
+from app.lot_summary import lot_summaries
+from app.geo import grid, nearest_lots
+from app.lot_events import publish_spot_changes, spot_event, stream_lot_events
+from app.spot_sync import spot_changes, spot_dict
+from app.spot_map import compact_spot_map, wants_compact
+from app.user_stats import user_statistics
+from app.pagination import page_size, keyset_page
+from app.holds import create_hold, confirm_hold, cancel_hold, schedule_hold, DEFAULT_HOLD_MINUTES, MAX_HOLD_MINUTES
 
 user_bp = Blueprint('user', __name__, url_prefix='/api/user')
 
+# Largest fleet booking accepted by reserve_batch
+MAX_BATCH_SIZE = 500
+
 @user_bp.route('/<path:path>', methods=['OPTIONS'])
 def options_user(path, **kwargs):
     response = make_response()
     response.headers.add("Access-Control-Allow-Origin", "*")
-    response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization")
+    response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization,Idempotency-Key,If-None-Match")
     response.headers.add("Access-Control-Allow-Methods", "GET,POST,PUT,DELETE,OPTIONS")
     return response, 200
 
@@ -53,24 +70,19 @@ def get_ist_time():
 
 @user_bp.route('/parking-lots', methods=['GET'])
 @jwt_required()
-@cache.cached(timeout=60, key_prefix='user_lots')
+@cached_view('user_lots', tags=('lots',))
 def list_lots():
     try:
-        lots = ParkingLot.query.all()
         lots_data = []
         
-        for lot in lots:
-            # Count available spots
-            available_spots = ParkingSpot.query.filter_by(
-                lot_id=lot.id, 
-                status='A'
-            ).count()
-            
+        for lot, _, available_spots in lot_summaries():
             lots_data.append({
                 'id': lot.id,
                 'name': lot.prime_location_name,
                 'address': lot.address,
                 'pin_code': lot.pin_code,
+                'latitude': lot.latitude,
+                'longitude': lot.longitude,
                 'price_per_hour': lot.price,
                 'total_spots': lot.number_of_spots,
                 'available_spots': available_spots,
@@ -87,36 +99,75 @@ def list_lots():
             'error': str(e)
         }), 500
 
+# Nearest lots with free spots
+@user_bp.route('/parking-lots/nearest', methods=['GET'])
+@jwt_required()
+def nearest_parking_lots():
+    """The k nearest lots with at least min_free free spots.
+
+    Query params: lat and lon (or pin_code, searched from the middle of that
+    pin code's lots), k (default 5, max 50), min_free (default 1) and
+    radius_km (default 25, max 100).
+    """
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        if lat is None or lon is None:
+            pin_code = request.args.get('pin_code', '').strip()
+            center = grid.pin_code_center(pin_code) if pin_code else None
+            if center is None:
+                return jsonify({'success': False, 'error': 'lat and lon, or a known pin_code, are required'}), 400
+            lat, lon = center
+        if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            return jsonify({'success': False, 'error': 'Coordinates out of range'}), 400
+        k = min(max(request.args.get('k', 5, type=int), 1), 50)
+        min_free = max(request.args.get('min_free', 1, type=int), 1)
+        radius_km = request.args.get('radius_km', type=float)
+
+        lots_data = []
+        for distance, lot, free in nearest_lots(lat, lon, k, min_free, radius_km):
+            lots_data.append({
+                'id': lot.id,
+                'name': lot.prime_location_name,
+                'address': lot.address,
+                'pin_code': lot.pin_code,
+                'latitude': lot.latitude,
+                'longitude': lot.longitude,
+                'price_per_hour': lot.price,
+                'total_spots': lot.number_of_spots,
+                'available_spots': free,
+                'distance_km': round(distance, 3)
+            })
+        return jsonify({'success': True, 'lots': lots_data}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Get lot details with spot status
 @user_bp.route('/parking-lots/<int:lot_id>', methods=['GET'])
 @jwt_required()
-@cache.cached(timeout=60, key_prefix=lambda: f'user_lot_{request.view_args["lot_id"]}')
+@cached_view('user_lot_{lot_id}', tags=('lot:{lot_id}',), query_args=('format',))
 def get_lot_details(lot_id):
+    """Lot with its spots; ?format=compact sends a run-length spot map instead."""
     try:
         lot = ParkingLot.query.get_or_404(lot_id)
-        spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
-        
-        spots_data = []
-        for spot in spots:
-            spots_data.append({
-                'id': spot.id,
-                'spot_number': spot.spot_number,
-                'status': spot.status,
-                'is_occupied': spot.is_occupied,
-                'is_available': spot.status == 'A'
-            })
+        lot_data = {
+            'id': lot.id,
+            'name': lot.prime_location_name,
+            'address': lot.address,
+            'pin_code': lot.pin_code,
+            'price_per_hour': lot.price,
+            'total_spots': lot.number_of_spots,
+            'version': lot.spot_version
+        }
+        if wants_compact(request):
+            lot_data['spot_map'] = compact_spot_map(lot_id)
+        else:
+            spots = ParkingSpot.query.filter_by(lot_id=lot_id).order_by(ParkingSpot.spot_number).all()
+            lot_data['spots'] = [spot_dict(spot) for spot in spots]
         
         return jsonify({
             'success': True,
-            'lot': {
-                'id': lot.id,
-                'name': lot.prime_location_name,
-                'address': lot.address,
-                'pin_code': lot.pin_code,
-                'price_per_hour': lot.price,
-                'total_spots': lot.number_of_spots,
-                'spots': spots_data
-            }
+            'lot': lot_data
         }), 200
     except Exception as e:
         return jsonify({
@@ -124,9 +175,47 @@ def get_lot_details(lot_id):
             'error': str(e)
         }), 500
 
+# Spots changed since a version the client already has
+@user_bp.route('/parking-lots/<int:lot_id>/changes', methods=['GET'])
+@jwt_required()
+def lot_spot_changes(lot_id):
+    """Spots changed after ?since=<version> (from get_lot_details or a previous call).
+
+    Returns only the changed spots with 'full': false, or the whole map with
+    'full': true when since is missing or the client is too far behind.
+    """
+    try:
+        since = request.args.get('since', type=int)
+        changes = spot_changes(lot_id, since)
+        if changes is None:
+            return jsonify({'success': False, 'error': 'Parking lot not found'}), 404
+        return jsonify({
+            'success': True,
+            'lot_id': lot_id,
+            **changes
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Live spot changes of a lot
+@user_bp.route('/parking-lots/<int:lot_id>/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def lot_events(lot_id):
+    """Server-Sent Events stream of spot changes in the lot.
+
+    EventSource cannot set headers, so the token may also be passed as ?jwt=.
+    """
+    try:
+        if db.session.get(ParkingLot, lot_id) is None:
+            return jsonify({'success': False, 'error': 'Parking lot not found'}), 404
+        return stream_lot_events(lot_id, request.headers.get('Last-Event-ID'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Reserve a spot in a lot
 @user_bp.route('/parking-lots/<int:lot_id>/reserve', methods=['POST'])
 @jwt_required()
+@idempotent
 def reserve_spot(lot_id):
     try:
         user_id = get_current_user_id()
@@ -144,15 +233,19 @@ def reserve_spot(lot_id):
         if not vehicle_number:
             return jsonify({'success': False, 'error': 'Vehicle number is required'}), 400
         lot = ParkingLot.query.get_or_404(lot_id)
-        available_spot = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').first()
-        if not available_spot:
-            return jsonify({'success': False, 'error': 'No available spots in this parking lot'}), 400
         # Prevent second time booking if this vehicle is already parked
         active_reservation = Reservation.query.filter_by(vehicle_number=vehicle_number, leaving_timestamp=None).first()
         if active_reservation:
             return jsonify({'success': False, 'error': 'This vehicle already has an active reservation. Please release it first.'}), 400
+        if SpotHold.query.filter_by(vehicle_number=vehicle_number, status='Held').first():
+            return jsonify({'success': False, 'error': 'This vehicle has a spot on hold. Confirm or cancel it first.'}), 400
+        # Claim a spot with a conditional update so two workers cannot take the same one
+        claimed = claim_spot(lot_id)
+        if not claimed:
+            return jsonify({'success': False, 'error': 'No available spots in this parking lot'}), 400
+        spot_id, spot_number = claimed
         reservation = Reservation(
-            spot_id=available_spot.id,
+            spot_id=spot_id,
             user_id=user_id,
             parking_lot_id=lot_id,
             parking_timestamp=get_ist_time(),
@@ -162,23 +255,29 @@ def reserve_spot(lot_id):
             remarks=remarks,
             status='Active'
         )
-        # Update spot status
-        spot = available_spot
-        spot.status = 'O'
-        spot.is_occupied = True
-        spot.current_reservation_id = reservation.id
-        # Update parking lot occupied count
-        lot.occupied = ParkingSpot.query.filter_by(lot_id=lot_id, is_occupied=True).count()
-        db.session.add(reservation)
-        db.session.commit()
-        cache.delete('user_lots')
-        cache.delete(f'user_lot_{lot_id}')
+        try:
+            db.session.add(reservation)
+            db.session.flush()
+            db.session.execute(
+                update(ParkingSpot)
+                .where(ParkingSpot.id == spot_id)
+                .values(current_reservation_id=reservation.id)
+                .execution_options(synchronize_session=False)
+            )
+            adjust_occupied(lot_id, 1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            get_allocator(lot_id).release(spot_number, spot_id)
+            raise
+        invalidate_lot_views(lot_id)
+        publish_spot_changes(lot_id, [spot_event(spot_id, spot_number, 'O')])
         return jsonify({
             'success': True,
             'message': 'Spot reserved successfully',
             'reservation': {
                 'id': reservation.id,
-                'spot_number': available_spot.spot_number,
+                'spot_number': spot_number,
                 'lot_name': lot.prime_location_name,
                 'parking_timestamp': reservation.parking_timestamp.isoformat(),
                 'vehicle_number': reservation.vehicle_number
@@ -189,61 +288,288 @@ def reserve_spot(lot_id):
         print("Error booking spot:", traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Reserve spots for many vehicles at once (fleet and event bookings)
+@user_bp.route('/parking-lots/<int:lot_id>/reserve-batch', methods=['POST'])
+@jwt_required()
+@idempotent
+def reserve_batch(lot_id):
+    try:
+        user_id = get_current_user_id()
+        user = User.query.get(user_id)
+        if user.flagged:
+            admin = User.query.filter_by(role='admin').first()
+            admin_phone = admin.phone_number if admin else 'N/A'
+            return jsonify({'success': False, 'error': f'Your account is flagged. Please contact support: {admin_phone}'}), 403
+        data = request.get_json() or {}
+        vehicles = data.get('vehicles') or []
+        all_or_nothing = data.get('all_or_nothing', True)
+        if not isinstance(vehicles, list) or not vehicles:
+            return jsonify({'success': False, 'error': 'A list of vehicles is required'}), 400
+        if len(vehicles) > MAX_BATCH_SIZE:
+            return jsonify({'success': False, 'error': f'At most {MAX_BATCH_SIZE} vehicles can be reserved at once'}), 400
+        lot = ParkingLot.query.get_or_404(lot_id)
+
+        # Checking every plate with one query
+        plates = [(v.get('vehicle_number') or '').strip() if isinstance(v, dict) else '' for v in vehicles]
+        already_parked = {row[0] for row in db.session.query(Reservation.vehicle_number).filter(
+            Reservation.vehicle_number.in_([p for p in plates if p]),
+            Reservation.leaving_timestamp.is_(None)
+        ).all()}
+        on_hold = {row[0] for row in db.session.query(SpotHold.vehicle_number).filter(
+            SpotHold.vehicle_number.in_([p for p in plates if p]),
+            SpotHold.status == 'Held'
+        ).all()}
+        results = []
+        accepted = []
+        seen = set()
+        for index, plate in enumerate(plates):
+            error = None
+            if not plate:
+                error = 'Vehicle number is required'
+            elif plate in already_parked:
+                error = 'This vehicle already has an active reservation. Please release it first.'
+            elif plate in on_hold:
+                error = 'This vehicle has a spot on hold. Confirm or cancel it first.'
+            elif plate in seen:
+                error = 'Vehicle appears more than once in this batch'
+            seen.add(plate)
+            results.append({'vehicle_number': plate, 'success': error is None, 'error': error})
+            if error is None:
+                accepted.append(index)
+
+        if all_or_nothing and len(accepted) < len(vehicles):
+            return jsonify({'success': False, 'error': 'Some vehicles cannot be reserved', 'results': results}), 400
+
+        claimed = claim_spots(lot_id, len(accepted)) if accepted else []
+        if all_or_nothing and len(claimed) < len(accepted):
+            db.session.rollback()
+            allocator = get_allocator(lot_id)
+            for spot_id, spot_number in claimed:
+                allocator.release(spot_number, spot_id)
+            return jsonify({
+                'success': False,
+                'error': f'Only {len(claimed)} spots are available for {len(accepted)} vehicles'
+            }), 400
+
+        parking_timestamp = get_ist_time()
+        reservations = []
+        for index, (spot_id, spot_number) in zip(accepted, claimed):
+            vehicle = vehicles[index]
+            reservation = Reservation(
+                spot_id=spot_id,
+                user_id=user_id,
+                parking_lot_id=lot_id,
+                parking_timestamp=parking_timestamp,
+                vehicle_number=plates[index],
+                phone_number=vehicle.get('phone_number', ''),
+                customer_name=vehicle.get('customer_name', ''),
+                remarks=vehicle.get('remarks', ''),
+                status='Active'
+            )
+            reservations.append((index, spot_number, reservation))
+        for index in accepted[len(claimed):]:
+            results[index].update(success=False, error='No available spots in this parking lot')
+
+        try:
+            db.session.add_all([reservation for _, _, reservation in reservations])
+            db.session.flush()
+            if reservations:
+                db.session.execute(update(ParkingSpot), [
+                    {'id': reservation.spot_id, 'current_reservation_id': reservation.id}
+                    for _, _, reservation in reservations
+                ])
+                adjust_occupied(lot_id, len(reservations))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            allocator = get_allocator(lot_id)
+            for spot_id, spot_number in claimed:
+                allocator.release(spot_number, spot_id)
+            raise
+        if reservations:
+            invalidate_lot_views(lot_id)
+            publish_spot_changes(lot_id, [
+                spot_event(reservation.spot_id, spot_number, 'O') for _, spot_number, reservation in reservations
+            ])
+
+        for index, spot_number, reservation in reservations:
+            results[index]['reservation'] = {
+                'id': reservation.id,
+                'spot_number': spot_number,
+                'lot_name': lot.prime_location_name,
+                'parking_timestamp': reservation.parking_timestamp.isoformat(),
+                'vehicle_number': reservation.vehicle_number
+            }
+        return jsonify({
+            'success': bool(reservations),
+            'message': f'{len(reservations)} of {len(vehicles)} vehicles reserved',
+            'reserved': len(reservations),
+            'failed': len(vehicles) - len(reservations),
+            'results': results
+        }), 201 if reservations else 400
+    except Exception as e:
+        db.session.rollback()
+        print("Error booking batch:", traceback.format_exc())
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Hold a spot for a few minutes before confirming the booking
+@user_bp.route('/parking-lots/<int:lot_id>/hold', methods=['POST'])
+@jwt_required()
+@idempotent
+def hold_spot(lot_id):
+    try:
+        user_id = get_current_user_id()
+        user = User.query.get(user_id)
+        if user.flagged:
+            admin = User.query.filter_by(role='admin').first()
+            admin_phone = admin.phone_number if admin else 'N/A'
+            return jsonify({'success': False, 'error': f'Your account is flagged. Please contact support: {admin_phone}'}), 403
+        data = request.get_json() or {}
+        vehicle_number = data.get('vehicle_number')
+        if not vehicle_number:
+            return jsonify({'success': False, 'error': 'Vehicle number is required'}), 400
+        try:
+            minutes = int(data.get('minutes', DEFAULT_HOLD_MINUTES))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'minutes must be a whole number'}), 400
+        if minutes < 1 or minutes > MAX_HOLD_MINUTES:
+            return jsonify({'success': False, 'error': f'Holds can last between 1 and {MAX_HOLD_MINUTES} minutes'}), 400
+        lot = ParkingLot.query.get_or_404(lot_id)
+        active_reservation = Reservation.query.filter_by(vehicle_number=vehicle_number, leaving_timestamp=None).first()
+        active_hold = SpotHold.query.filter_by(vehicle_number=vehicle_number, status='Held').first()
+        if active_reservation or active_hold:
+            return jsonify({'success': False, 'error': 'This vehicle already has an active reservation or hold.'}), 400
+        held = create_hold(user_id, lot_id, data, minutes)
+        if not held:
+            return jsonify({'success': False, 'error': 'No available spots in this parking lot'}), 400
+        hold, spot_number = held
+        schedule_hold(current_app._get_current_object(), hold.id, hold.expires_at)
+        return jsonify({
+            'success': True,
+            'message': 'Spot held successfully',
+            'hold': {
+                'id': hold.id,
+                'spot_number': spot_number,
+                'lot_name': lot.prime_location_name,
+                'vehicle_number': hold.vehicle_number,
+                'expires_at': hold.expires_at.isoformat()
+            }
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        print("Error holding spot:", traceback.format_exc())
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Confirm a hold into a reservation
+@user_bp.route('/holds/<int:hold_id>/confirm', methods=['POST'])
+@jwt_required()
+@idempotent
+def confirm_spot_hold(hold_id):
+    try:
+        user_id = get_current_user_id()
+        hold = SpotHold.query.filter_by(id=hold_id, user_id=user_id).first_or_404()
+        if Reservation.query.filter_by(vehicle_number=hold.vehicle_number, leaving_timestamp=None).first():
+            return jsonify({'success': False, 'error': 'This vehicle already has an active reservation. Please release it first.'}), 400
+        reservation = confirm_hold(hold)
+        if not reservation:
+            return jsonify({'success': False, 'error': 'This hold has expired or was already used'}), 400
+        return jsonify({
+            'success': True,
+            'message': 'Spot reserved successfully',
+            'reservation': {
+                'id': reservation.id,
+                'spot_number': reservation.spot.spot_number,
+                'lot_name': reservation.lot.prime_location_name,
+                'parking_timestamp': reservation.parking_timestamp.isoformat(),
+                'vehicle_number': reservation.vehicle_number
+            }
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Give a held spot back before it expires
+@user_bp.route('/holds/<int:hold_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_spot_hold(hold_id):
+    try:
+        user_id = get_current_user_id()
+        hold = SpotHold.query.filter_by(id=hold_id, user_id=user_id).first_or_404()
+        if not cancel_hold(hold):
+            return jsonify({'success': False, 'error': 'This hold has expired or was already used'}), 400
+        return jsonify({'success': True, 'message': 'Hold cancelled successfully'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # User's reservation history
 @user_bp.route('/reservations', methods=['GET'])
 @jwt_required()
 def reservation_history():
+    """One page of the user's reservations, newest first (limit, cursor).
+
+    The ETag follows users.history_version, which triggers bump on any change
+    to the user's reservations, so an unchanged history answers 304 without
+    querying or serializing reservations.
+    """
     try:
         user_id = get_current_user_id()
-        
-        reservations = Reservation.query.filter_by(user_id=user_id).order_by(
-            Reservation.parking_timestamp.desc()
-        ).all()
-        
+        version = db.session.query(User.history_version).filter(User.id == user_id).scalar()
+        page = hashlib.sha1(request.query_string).hexdigest()[:12]
+        etag = f"history-{user_id}-{version}-{page}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        limit = page_size(request.args.get('limit'))
+        query = db.session.query(
+            Reservation.id,
+            Reservation.vehicle_number,
+            Reservation.parking_timestamp,
+            Reservation.leaving_timestamp,
+            Reservation.parking_cost,
+            Reservation.remarks,
+            ParkingLot.prime_location_name,
+            ParkingSpot.spot_number
+        ).outerjoin(ParkingLot, ParkingLot.id == Reservation.parking_lot_id
+        ).outerjoin(ParkingSpot, ParkingSpot.id == Reservation.spot_id
+        ).filter(Reservation.user_id == user_id)
+        rows, next_cursor = keyset_page(query, Reservation.parking_timestamp, Reservation.id,
+                                        request.args.get('cursor'), limit)
+
         reservations_data = []
-        for reservation in reservations:
-            # Get lot and spot details safely
-            lot_name = "Unknown"
-            spot_number = "Unknown"
-            
-            try:
-                lot = ParkingLot.query.get(reservation.parking_lot_id)
-                lot_name = lot.prime_location_name if lot else "Unknown"
-            except Exception as e:
-                print(f"Error getting lot for reservation {reservation.id}: {e}")
-                lot_name = "Unknown"
-            
-            try:
-                spot = ParkingSpot.query.get(reservation.spot_id)
-                spot_number = spot.spot_number if spot else "Unknown"
-            except Exception as e:
-                print(f"Error getting spot for reservation {reservation.id}: {e}")
-                spot_number = "Unknown"
-            
+        for r in rows:
             # Calculate duration and cost if its completed
             duration = None
             cost = None
-            if reservation.leaving_timestamp:
-                duration = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600  # hours
-                cost = reservation.parking_cost
-            
+            if r.leaving_timestamp:
+                duration = (r.leaving_timestamp - r.parking_timestamp).total_seconds() / 3600  # hours
+                cost = r.parking_cost
+
             reservations_data.append({
-                'id': reservation.id,
-                'spot_number': spot_number,
-                'lot_name': lot_name,
-                'vehicle_number': reservation.vehicle_number,
-                'parking_timestamp': reservation.parking_timestamp.isoformat(),
-                'leaving_timestamp': reservation.leaving_timestamp.isoformat() if reservation.leaving_timestamp else None,
+                'id': r.id,
+                'spot_number': r.spot_number if r.spot_number is not None else "Unknown",
+                'lot_name': r.prime_location_name if r.prime_location_name is not None else "Unknown",
+                'vehicle_number': r.vehicle_number,
+                'parking_timestamp': r.parking_timestamp.isoformat(),
+                'leaving_timestamp': r.leaving_timestamp.isoformat() if r.leaving_timestamp else None,
                 'duration_hours': round(duration, 2) if duration else None,
                 'cost': cost,
-                'status': 'Active' if not reservation.leaving_timestamp else 'Completed',
-                'remarks': reservation.remarks
+                'status': 'Active' if not r.leaving_timestamp else 'Completed',
+                'remarks': r.remarks
             })
-        
-        return jsonify({
+
+        response = make_response(jsonify({
             'success': True,
-            'reservations': reservations_data
-        }), 200
+            'reservations': reservations_data,
+            'next_cursor': next_cursor
+        }), 200)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         print(f"Error in reservation_history: {e}")
         print(f"Traceback: {traceback.format_exc()}")
@@ -313,6 +639,7 @@ def get_active_reservation():
 # Release a spot
 @user_bp.route('/reservations/<int:reservation_id>/release', methods=['POST'])
 @jwt_required()
+@idempotent
 def release_spot(reservation_id):
     try:
         user_id = get_current_user_id()
@@ -320,23 +647,15 @@ def release_spot(reservation_id):
         if reservation.leaving_timestamp:
             return jsonify({'success': False, 'error': 'This reservation has already been released'}), 400
         leaving_time = get_ist_time().replace(tzinfo=None)
-        duration_hours = (leaving_time - reservation.parking_timestamp).total_seconds() / 3600
-        cost = round(duration_hours * reservation.lot.price, 2)
-        reservation.leaving_timestamp = leaving_time
-        reservation.parking_cost = cost
-        reservation.status = 'Completed'
-        spot = reservation.spot
-        spot.status = 'A'
-        spot.is_occupied = False
-        spot.current_reservation_id = None
-        
-        # Update parking lot occupied count
-        lot = reservation.lot
-        lot.occupied = ParkingSpot.query.filter_by(lot_id=lot.id, is_occupied=True).count()
-        
+        # Only the request that flips the reservation from active wins a concurrent release
+        completed = complete_reservations(active_reservations_query(Reservation.id == reservation.id), leaving_time)
+        if not completed:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'This reservation has already been released'}), 400
         db.session.commit()
-        cache.delete('user_lots')
-        cache.delete(f'user_lot_{lot.id}')
+        after_checkout(completed)
+        duration_hours = completed[0]['duration_hours']
+        cost = completed[0]['cost']
         return jsonify({
             'success': True,
             'message': 'Spot released successfully',
@@ -358,30 +677,18 @@ def user_summary():
     try:
         user_id = get_current_user_id()
         
-        # Get user's reservations
-        reservations = Reservation.query.filter_by(user_id=user_id).all()
-        
-        total_reservations = len(reservations)
-        completed_reservations = len([r for r in reservations if r.leaving_timestamp])
-        active_reservations = len([r for r in reservations if not r.leaving_timestamp])
-        
-        total_cost = sum([r.parking_cost or 0 for r in reservations])
-        total_hours = sum([
-            (r.leaving_timestamp - r.parking_timestamp).total_seconds() / 3600 
-            for r in reservations if r.leaving_timestamp
-        ])
+        stats = user_statistics(user_id)
+        total_reservations = stats['total']
+        completed_reservations = stats['completed']
+        active_reservations = stats['active']
+        total_cost = stats['cost']
+        total_hours = stats['hours']
         
         # Monthly breakdown
-        monthly_data = {}
-        for reservation in reservations:
-            if reservation.leaving_timestamp:
-                month = reservation.parking_timestamp.strftime('%Y-%m')
-                if month not in monthly_data:
-                    monthly_data[month] = {'count': 0, 'cost': 0, 'hours': 0}
-                
-                monthly_data[month]['count'] += 1
-                monthly_data[month]['cost'] += reservation.parking_cost or 0
-                monthly_data[month]['hours'] += (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600
+        monthly_data = {
+            m.month: {'count': m.completed, 'cost': m.cost, 'hours': m.hours}
+            for m in stats['months']
+        }
         
         return jsonify({
             'success': True,
@@ -427,34 +734,27 @@ def get_user_analytics():
     try:
         user_id = get_current_user_id()
         
-        # Get user's reservations
-        reservations = Reservation.query.filter_by(user_id=user_id).all()
-        
-        # Calculate summary
-        total_cost = sum(r.parking_cost or 0 for r in reservations if r.leaving_timestamp)
-        total_reservations = len(reservations)
-        active_reservations = len([r for r in reservations if not r.leaving_timestamp])
-        completed_reservations = len([r for r in reservations if r.leaving_timestamp])
+        stats = user_statistics(user_id)
+        total_cost = stats['cost']
+        total_reservations = stats['total']
+        active_reservations = stats['active']
+        completed_reservations = stats['completed']
+        total_hours = stats['hours']
         
-        # Calculate total hours from completed reservations
-        total_hours = sum([
-            (r.leaving_timestamp - r.parking_timestamp).total_seconds() / 3600 
-            for r in reservations if r.leaving_timestamp
-        ])
-        
-        # Calculate monthly data
+        # Calculate monthly data (by month name; active reservations count in the month they started)
         monthly_data = {}
         
-        for reservation in reservations:
-            if reservation.parking_timestamp:
-                month = reservation.parking_timestamp.strftime('%B')
-                if month not in monthly_data:
-                    monthly_data[month] = {'count': 0, 'cost': 0, 'hours': 0}
-                
-                monthly_data[month]['count'] += 1
-                if reservation.leaving_timestamp:
-                    monthly_data[month]['cost'] += reservation.parking_cost or 0
-                    monthly_data[month]['hours'] += (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600
+        def month_entry(month):
+            name = datetime.strptime(month, '%Y-%m').strftime('%B')
+            return monthly_data.setdefault(name, {'count': 0, 'cost': 0, 'hours': 0})
+        
+        for m in stats['months']:
+            entry = month_entry(m.month)
+            entry['count'] += m.completed
+            entry['cost'] += m.cost
+            entry['hours'] += m.hours
+        for month, count in stats['active_by_month'].items():
+            month_entry(month)['count'] += count
         
         return jsonify({
             'summary': {
@@ -0,0 +1,107 @@
+from collections import Counter
+from sqlalchemy import update
+from .models import db, ParkingLot, ParkingSpot, Reservation
+from .allocator import get_allocator
+from .occupancy import adjust_occupied
+from .pricing import price_reservations
+from .rollups import record_completions
+from .user_stats import record_user_completions
+from .view_cache import invalidate_lot_views
+from .lot_events import publish_spot_changes, spot_event
+
+# Completing (checking out) reservations. release_spot and the admin bulk
+# release go through the same path, so pricing, spot flips, counters,
+# analytics rollups and user statistics behave identically for one
+# reservation or hundreds.
+
+
+def active_reservations_query(*criteria):
+    """Active reservations with what checkout needs, in one joined query."""
+    return db.session.query(
+        Reservation.id,
+        Reservation.spot_id,
+        Reservation.user_id,
+        Reservation.parking_lot_id,
+        Reservation.parking_timestamp,
+        ParkingLot.price,
+        ParkingLot.tariff,
+        ParkingSpot.spot_number
+    ).join(
+        ParkingLot, ParkingLot.id == Reservation.parking_lot_id
+    ).outerjoin(
+        ParkingSpot, ParkingSpot.id == Reservation.spot_id
+    ).filter(Reservation.leaving_timestamp.is_(None), *criteria)
+
+
+def complete_reservations(rows, leaving_time):
+    """Price and close the given active reservation rows and free their spots.
+
+    Rows come from active_reservations_query(). Reservations released
+    concurrently by someone else are skipped. Runs in the caller's
+    transaction; call after_checkout() once it has committed.
+    """
+    rows = {row.id: row for row in rows}
+    if not rows:
+        return []
+    # Only reservations still active when the UPDATE runs are completed here
+    won = db.session.execute(
+        update(Reservation)
+        .where(Reservation.id.in_(rows), Reservation.leaving_timestamp.is_(None))
+        .values(leaving_timestamp=leaving_time, status='Completed')
+        .returning(Reservation.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if not won:
+        return []
+
+    won_rows = [rows[reservation_id] for reservation_id in won]
+    hours, costs = price_reservations(
+        [row.parking_lot_id for row in won_rows],
+        [row.price for row in won_rows],
+        [row.tariff for row in won_rows],
+        [row.parking_timestamp for row in won_rows],
+        [leaving_time] * len(won_rows)
+    )
+    completed = []
+    for row, duration_hours, cost in zip(won_rows, hours.tolist(), costs.tolist()):
+        completed.append({
+            'id': row.id,
+            'spot_id': row.spot_id,
+            'spot_number': row.spot_number,
+            'lot_id': row.parking_lot_id,
+            'user_id': row.user_id,
+            'parking_timestamp': row.parking_timestamp,
+            'duration_hours': duration_hours,
+            'cost': cost,
+            'leaving_timestamp': leaving_time
+        })
+    db.session.execute(update(Reservation), [
+        {'id': item['id'], 'parking_cost': item['cost']} for item in completed
+    ])
+    record_completions(completed)
+    record_user_completions(completed)
+
+    freed = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id.in_([item['spot_id'] for item in completed]), ParkingSpot.status == 'O')
+        .values(status='A', is_occupied=False, current_reservation_id=None)
+        .returning(ParkingSpot.lot_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    for lot_id, count in Counter(freed).items():
+        adjust_occupied(lot_id, -count)
+    return completed
+
+
+def after_checkout(completed):
+    """Hand freed spots back to the allocators and invalidate caches once per lot."""
+    freed = {}
+    for item in completed:
+        spots = freed.setdefault(item['lot_id'], [])
+        if item['spot_number'] is not None:
+            get_allocator(item['lot_id']).release(item['spot_number'], item['spot_id'])
+            spots.append(spot_event(item['spot_id'], item['spot_number'], 'A'))
+    if freed:
+        invalidate_lot_views(*freed)
+    for lot_id, spots in freed.items():
+        publish_spot_changes(lot_id, spots)
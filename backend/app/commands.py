@@ -0,0 +1,129 @@
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import update
+from .models import db, ParkingLot, Reservation
+from .migrations import upgrade, current_version, check_query_plans
+from .pricing import price_reservations
+from .rollups import rebuild_rollups
+from .user_stats import rebuild_user_stats
+
+# Flask CLI commands (run with `flask <command>` from the backend directory)
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Apply pending schema migrations."""
+    applied = upgrade()
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(map(str, applied))}")
+    click.echo(f"Schema version: {current_version()}")
+
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if a hot query path is not answered from its index."""
+    failures = check_query_plans()
+    for name, plan in failures.items():
+        click.echo(f"NOT INDEXED: {name}")
+        for step in plan:
+            click.echo(f"    {step}")
+    if failures:
+        raise SystemExit(1)
+    click.echo("All hot query paths use an index.")
+
+
+@click.command('reprice-reservations')
+@with_appcontext
+@click.option('--lot-id', type=int, help='Only reservations of this lot.')
+@click.option('--since', type=click.DateTime(), help='Parked on or after this date.')
+@click.option('--until', type=click.DateTime(), help='Parked before this date.')
+@click.option('--dry-run', is_flag=True, help='Report the revenue change without saving it.')
+@click.option('--chunk-size', type=int, default=50000, show_default=True)
+def reprice_reservations_command(lot_id, since, until, dry_run, chunk_size):
+    """Recompute parking_cost of completed reservations with the current tariffs."""
+    query = db.session.query(
+        Reservation.id,
+        Reservation.user_id,
+        Reservation.parking_lot_id,
+        ParkingLot.price,
+        ParkingLot.tariff,
+        Reservation.parking_timestamp,
+        Reservation.leaving_timestamp,
+        Reservation.parking_cost
+    ).join(ParkingLot, ParkingLot.id == Reservation.parking_lot_id).filter(
+        Reservation.leaving_timestamp.isnot(None)
+    )
+    if lot_id:
+        query = query.filter(Reservation.parking_lot_id == lot_id)
+    if since:
+        query = query.filter(Reservation.parking_timestamp >= since)
+    if until:
+        query = query.filter(Reservation.parking_timestamp < until)
+
+    started = datetime.now()
+    last_id = 0
+    total = changed = 0
+    changed_users = set()
+    old_revenue = new_revenue = 0.0
+    while True:
+        rows = query.filter(Reservation.id > last_id).order_by(Reservation.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        _, costs = price_reservations(
+            [r.parking_lot_id for r in rows], [r.price for r in rows], [r.tariff for r in rows],
+            [r.parking_timestamp for r in rows], [r.leaving_timestamp for r in rows]
+        )
+        updates = []
+        for row, cost in zip(rows, costs.tolist()):
+            old_revenue += row.parking_cost or 0
+            new_revenue += cost
+            if row.parking_cost != cost:
+                updates.append({'id': row.id, 'parking_cost': cost})
+                changed_users.add(row.user_id)
+        total += len(rows)
+        changed += len(updates)
+        if updates and not dry_run:
+            db.session.execute(update(Reservation), updates)
+            db.session.commit()
+    if changed and not dry_run:
+        rebuild_rollups(lot_id, since, until)
+        rebuild_user_stats(changed_users)
+        db.session.commit()
+    click.echo(f"Repriced {total} reservations in {(datetime.now() - started).total_seconds():.1f}s, {changed} changed")
+    click.echo(f"Revenue: {old_revenue:.2f} -> {new_revenue:.2f}" + (' (dry run)' if dry_run else ''))
+
+
+@click.command('backfill-rollups')
+@with_appcontext
+@click.option('--lot-id', type=int, help='Only this lot.')
+@click.option('--since', type=click.DateTime(), help='First parking date to rebuild.')
+@click.option('--until', type=click.DateTime(), help='Rebuild days before this date.')
+def backfill_rollups_command(lot_id, since, until):
+    """Rebuild the hourly and daily analytics rollups from reservations."""
+    started = datetime.now()
+    days = rebuild_rollups(lot_id, since, until)
+    db.session.commit()
+    click.echo(f"Rebuilt {days} daily lot buckets in {(datetime.now() - started).total_seconds():.1f}s")
+
+
+@click.command('backfill-user-stats')
+@with_appcontext
+@click.option('--user-id', type=int, multiple=True, help='Only these users (repeatable).')
+def backfill_user_stats_command(user_id):
+    """Rebuild the per-user statistics projection from reservations."""
+    started = datetime.now()
+    rebuild_user_stats(user_id or None)
+    db.session.commit()
+    click.echo(f"Rebuilt user statistics in {(datetime.now() - started).total_seconds():.1f}s")
+
+
+def register_commands(app):
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(reprice_reservations_command)
+    app.cli.add_command(backfill_rollups_command)
+    app.cli.add_command(backfill_user_stats_command)
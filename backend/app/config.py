@@ -11,6 +11,11 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': 60 * 60 * 24 * 30,  # every 30 days (approx)
         'options': {'expires': 60 * 60 * 24},
     },
+    'reconcile-lot-occupancy': {
+        'task': 'app.tasks.occupancy.reconcile_lot_occupancy',
+        'schedule': 60 * 15,  # every 15 minutes
+        'options': {'expires': 60 * 10},
+    },
 }
 
 CELERY_TIMEZONE = 'Asia/Kolkata'
@@ -0,0 +1,173 @@
+import math
+import threading
+from sqlalchemy import func
+from .models import db, ParkingLot
+
+# Process-local spatial index of parking lots for nearest-lot lookups.
+#
+# Lots with coordinates are bucketed into a grid of CELL_DEGREES cells. A
+# query walks rings of cells outwards from the driver's cell until no further
+# cell can be within the search radius (DEFAULT_SEARCH_KM unless given, at
+# most MAX_SEARCH_KM), so it only touches lots near the driver. The lots in
+# range are ranked in memory; only the nearest of them go to the database,
+# for their rows and free spots (the occupied counter).
+
+CELL_DEGREES = 0.05  # ~5.5km north-south
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+DEFAULT_SEARCH_KM = 25.0
+MAX_SEARCH_KM = 100.0
+MAX_RINGS = 40  # caps the walk where cells are narrow (far from the equator)
+CANDIDATE_BATCH = 32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell(lat, lon):
+    return int(math.floor(lat / CELL_DEGREES)), int(math.floor(lon / CELL_DEGREES))
+
+
+class LotGrid:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells = {}   # (row, col) -> {lot_id: (lat, lon)}
+        self._lots = {}    # lot_id -> (cell, lat, lon, pin_code)
+        self._pins = {}    # pin_code -> {lot_id}
+
+    def put(self, lot_id, lat, lon, pin_code=None):
+        with self._lock:
+            self._remove(lot_id)
+            if lat is None or lon is None:
+                return
+            cell = _cell(lat, lon)
+            self._cells.setdefault(cell, {})[lot_id] = (lat, lon)
+            self._lots[lot_id] = (cell, lat, lon, pin_code)
+            if pin_code:
+                self._pins.setdefault(pin_code, set()).add(lot_id)
+
+    def remove(self, lot_id):
+        with self._lock:
+            self._remove(lot_id)
+
+    def _remove(self, lot_id):
+        entry = self._lots.pop(lot_id, None)
+        if entry is None:
+            return
+        cell, _, _, pin_code = entry
+        self._cells[cell].pop(lot_id, None)
+        if not self._cells[cell]:
+            del self._cells[cell]
+        if pin_code in self._pins:
+            self._pins[pin_code].discard(lot_id)
+            if not self._pins[pin_code]:
+                del self._pins[pin_code]
+
+    def load(self, rows):
+        """Rebuild from (lot_id, latitude, longitude, pin_code) rows."""
+        with self._lock:
+            self._cells, self._lots, self._pins = {}, {}, {}
+        for lot_id, lat, lon, pin_code in rows:
+            self.put(lot_id, lat, lon, pin_code)
+
+    def pin_code_center(self, pin_code):
+        """Mean position of the indexed lots with this pin code, or None."""
+        with self._lock:
+            points = [self._lots[lot_id][1:3] for lot_id in self._pins.get(pin_code, ())]
+        if not points:
+            return None
+        return sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)
+
+    def nearest(self, lat, lon, max_km, max_rings=MAX_RINGS):
+        """Indexed lots within max_km as [(distance_km, lot_id)], nearest first.
+
+        Walks at most max_rings rings of cells around the driver's cell.
+        """
+        row, col = _cell(lat, lon)
+        found = []
+        with self._lock:
+            for ring in range(max_rings + 1):
+                # Nothing in this ring or beyond is closer than this
+                gap = max(ring - 1, 0) * CELL_DEGREES
+                lon_scale = math.cos(math.radians(min(abs(lat) + (ring + 1) * CELL_DEGREES, 89.9)))
+                if gap * KM_PER_DEGREE * lon_scale > max_km:
+                    break
+                for cell in _ring_cells(row, col, ring):
+                    for lot_id, (lot_lat, lot_lon) in self._cells.get(cell, {}).items():
+                        distance = haversine_km(lat, lon, lot_lat, lot_lon)
+                        if distance <= max_km:
+                            found.append((distance, lot_id))
+        found.sort()
+        return found
+
+
+def _ring_cells(row, col, ring):
+    if ring == 0:
+        yield row, col
+        return
+    for c in range(col - ring, col + ring + 1):
+        yield row - ring, c
+        yield row + ring, c
+    for r in range(row - ring + 1, row + ring):
+        yield r, col - ring
+        yield r, col + ring
+
+
+grid = LotGrid()
+
+
+def rebuild_lot_grid():
+    grid.load(db.session.query(
+        ParkingLot.id, ParkingLot.latitude, ParkingLot.longitude, ParkingLot.pin_code
+    ).all())
+
+
+def index_lot(lot):
+    grid.put(lot.id, lot.latitude, lot.longitude, lot.pin_code)
+
+
+def nearest_lots(lat, lon, k, min_free=1, max_km=None):
+    """[(distance_km, lot, free_spots)] of the k closest lots with at least min_free free spots.
+
+    The grid orders the lots in range; their rows and free spots (the lot's
+    occupied counter) are then read nearest first, usually in one query.
+    """
+    max_km = min(max_km or DEFAULT_SEARCH_KM, MAX_SEARCH_KM)
+    candidates = grid.nearest(lat, lon, max_km)
+    available = func.max(ParkingLot.number_of_spots - func.coalesce(ParkingLot.occupied, 0), 0)
+    batch = max(4 * k, CANDIDATE_BATCH)
+    found = []
+    for start in range(0, len(candidates), batch):
+        chunk = candidates[start:start + batch]
+        rows = {lot.id: (lot, free) for lot, free in db.session.query(ParkingLot, available).filter(
+            ParkingLot.id.in_([lot_id for _, lot_id in chunk]), available >= min_free
+        ).all()}
+        found.extend((distance, *rows[lot_id]) for distance, lot_id in chunk if lot_id in rows)
+        if len(found) >= k:
+            break
+    return found[:k]
+
+
+def parse_coordinates(data, latitude=None, longitude=None):
+    """Validated (latitude, longitude) from request data, defaulting to the given values.
+
+    Both must be set together; null clears them.
+    """
+    if 'latitude' in data:
+        latitude = data['latitude']
+    if 'longitude' in data:
+        longitude = data['longitude']
+    # Blank form fields count as unset
+    latitude = None if latitude == '' else latitude
+    longitude = None if longitude == '' else longitude
+    if latitude is None and longitude is None:
+        return None, None
+    if latitude is None or longitude is None:
+        raise ValueError('latitude and longitude must be given together')
+    latitude, longitude = float(latitude), float(longitude)
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError('Coordinates out of range')
+    return latitude, longitude
@@ -0,0 +1,244 @@
+from datetime import datetime, timedelta
+import threading
+import time
+import pytz
+from sqlalchemy import update
+from .models import db, ParkingSpot, Reservation, SpotHold
+from .allocator import get_allocator, claim_spot
+from .occupancy import adjust_occupied
+from .checkout import invalidate_lot_views
+from .lot_events import publish_spot_changes, spot_event
+
+# Time-limited spot holds.
+#
+# A hold claims a free spot with status 'H' (counted as occupied) for a few
+# minutes while the driver drives in, then it is either confirmed into a
+# Reservation or released. Expiry runs on an in-process hashed timing wheel:
+# scheduling and cancelling are O(1) and each tick only looks at the holds
+# due in that slot, so there are no periodic scans of spot_holds. Every state
+# change is a conditional UPDATE, so confirm, cancel and expiry racing each
+# other (or several workers expiring the same hold) settle on one outcome.
+
+DEFAULT_HOLD_MINUTES = 15
+MAX_HOLD_MINUTES = 60
+
+
+def _now():
+    return datetime.now(pytz.timezone('Asia/Kolkata')).replace(tzinfo=None)
+
+
+class TimingWheel:
+    """Hashed timing wheel of hold ids keyed by deadline (epoch seconds)."""
+
+    def __init__(self, tick=1.0, slots=4096):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}
+        self.current = int(time.time() / tick)
+        self._lock = threading.Lock()
+
+    def schedule(self, hold_id, deadline):
+        with self._lock:
+            self.deadlines[hold_id] = deadline
+            # Deadlines already passed land in the next slot to be processed
+            tick = max(int(deadline / self.tick), self.current)
+            self.slots[tick % len(self.slots)].add(hold_id)
+
+    def cancel(self, hold_id):
+        with self._lock:
+            self.deadlines.pop(hold_id, None)
+
+    def advance(self, now):
+        """Return the ids of holds due by `now`."""
+        due = []
+        with self._lock:
+            target = int(now / self.tick)
+            while self.current <= target:
+                slot = self.slots[self.current % len(self.slots)]
+                for hold_id in list(slot):
+                    deadline = self.deadlines.get(hold_id)
+                    if deadline is None:
+                        slot.discard(hold_id)
+                    elif deadline <= now:
+                        slot.discard(hold_id)
+                        del self.deadlines[hold_id]
+                        due.append(hold_id)
+                    # Otherwise it is due on a later turn of the wheel
+                self.current += 1
+            self.current = target
+        return due
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+wheel = TimingWheel()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _run_expiry(app):
+    while True:
+        time.sleep(wheel.tick)
+        due = wheel.advance(time.time())
+        if not due:
+            continue
+        try:
+            with app.app_context():
+                expire_holds(due)
+        except Exception as e:
+            print(f"[HOLDS][ERROR] Failed to expire holds {due}: {e}")
+
+
+def ensure_expiry_worker(app):
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_expiry, args=(app,), name='hold-expiry', daemon=True)
+            _worker.start()
+
+
+def schedule_hold(app, hold_id, expires_at):
+    wheel.schedule(hold_id, time.time() + (expires_at - _now()).total_seconds())
+    ensure_expiry_worker(app)
+
+
+def load_active_holds(app):
+    """Put holds left active by a previous process back on the wheel."""
+    holds = db.session.query(SpotHold.id, SpotHold.expires_at).filter(SpotHold.status == 'Held').all()
+    for hold_id, expires_at in holds:
+        schedule_hold(app, hold_id, expires_at)
+
+
+def create_hold(user_id, lot_id, vehicle, minutes):
+    """Hold a free spot of the lot; returns (hold, spot_number) or None when full."""
+    claimed = claim_spot(lot_id, status='H')
+    if not claimed:
+        return None
+    spot_id, spot_number = claimed
+    hold = SpotHold(
+        spot_id=spot_id,
+        lot_id=lot_id,
+        user_id=user_id,
+        vehicle_number=vehicle['vehicle_number'],
+        phone_number=vehicle.get('phone_number', ''),
+        customer_name=vehicle.get('customer_name', ''),
+        remarks=vehicle.get('remarks', ''),
+        expires_at=_now() + timedelta(minutes=minutes),
+        status='Held'
+    )
+    try:
+        db.session.add(hold)
+        adjust_occupied(lot_id, 1)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        get_allocator(lot_id).release(spot_number, spot_id)
+        raise
+    invalidate_lot_views(lot_id)
+    publish_spot_changes(lot_id, [spot_event(spot_id, spot_number, 'H')])
+    return hold, spot_number
+
+
+def _end_hold(hold, status, *criteria):
+    result = db.session.execute(
+        update(SpotHold)
+        .where(SpotHold.id == hold.id, SpotHold.status == 'Held', *criteria)
+        .values(status=status)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _release_held_spot(hold):
+    result = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == hold.spot_id, ParkingSpot.status == 'H')
+        .values(status='A', is_occupied=False, current_reservation_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 1:
+        adjust_occupied(hold.lot_id, -1)
+        return True
+    return False
+
+
+def _after_release(hold):
+    spot_number = db.session.query(ParkingSpot.spot_number).filter(ParkingSpot.id == hold.spot_id).scalar()
+    if spot_number is not None:
+        get_allocator(hold.lot_id).release(spot_number, hold.spot_id)
+    invalidate_lot_views(hold.lot_id)
+    if spot_number is not None:
+        publish_spot_changes(hold.lot_id, [spot_event(hold.spot_id, spot_number, 'A')])
+
+
+def cancel_hold(hold):
+    if not _end_hold(hold, 'Cancelled'):
+        db.session.rollback()
+        return False
+    _release_held_spot(hold)
+    db.session.commit()
+    wheel.cancel(hold.id)
+    _after_release(hold)
+    return True
+
+
+def expire_holds(hold_ids):
+    holds = SpotHold.query.filter(SpotHold.id.in_(hold_ids), SpotHold.status == 'Held').all()
+    now = _now()
+    for hold in holds:
+        # Holds extended or confirmed meanwhile stay untouched
+        if _end_hold(hold, 'Expired', SpotHold.expires_at <= now):
+            _release_held_spot(hold)
+            db.session.commit()
+            _after_release(hold)
+        else:
+            db.session.rollback()
+            if hold.expires_at > now:
+                wheel.schedule(hold.id, time.time() + (hold.expires_at - now).total_seconds())
+
+
+def confirm_hold(hold):
+    """Turn an active hold into a Reservation; returns it or None if the hold ended.
+
+    Also None when the vehicle got an active reservation some other way
+    meanwhile; the hold is then left to expire or be cancelled.
+    """
+    parked = db.session.query(Reservation.id).filter(
+        Reservation.vehicle_number == hold.vehicle_number, Reservation.leaving_timestamp.is_(None)
+    ).first()
+    # Past its deadline the hold is expired even if the wheel has not run yet
+    if parked or not _end_hold(hold, 'Confirmed', SpotHold.expires_at > _now()):
+        db.session.rollback()
+        return None
+    reservation = Reservation(
+        spot_id=hold.spot_id,
+        user_id=hold.user_id,
+        parking_lot_id=hold.lot_id,
+        parking_timestamp=_now(),
+        vehicle_number=hold.vehicle_number,
+        phone_number=hold.phone_number,
+        customer_name=hold.customer_name,
+        remarks=hold.remarks,
+        status='Active'
+    )
+    db.session.add(reservation)
+    db.session.flush()
+    db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == hold.spot_id, ParkingSpot.status == 'H')
+        .values(status='O', current_reservation_id=reservation.id)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(SpotHold)
+        .where(SpotHold.id == hold.id)
+        .values(reservation_id=reservation.id)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    wheel.cancel(hold.id)
+    invalidate_lot_views(hold.lot_id)
+    spot_number = db.session.query(ParkingSpot.spot_number).filter(ParkingSpot.id == hold.spot_id).scalar()
+    publish_spot_changes(hold.lot_id, [spot_event(hold.spot_id, spot_number, 'O')])
+    return reservation
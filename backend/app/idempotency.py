@@ -0,0 +1,99 @@
+from functools import wraps
+import hashlib
+from flask import request, jsonify, make_response
+from flask_jwt_extended import get_jwt_identity
+from . import cache
+
+# Optional Idempotency-Key support for write endpoints. The first response for
+# a key is remembered for IDEMPOTENCY_TTL seconds and replayed for retries of
+# the same request without touching the database again.
+#
+# Keys live in the app cache (CACHE_BACKEND), so with the redis backend a
+# retry that lands on another worker is still recognised. The in-flight
+# marker is written with add(), which only one request can win; it expires
+# after IDEMPOTENCY_PENDING_TTL in case its worker dies mid-request.
+
+IDEMPOTENCY_TTL = 60 * 60 * 24
+IDEMPOTENCY_PENDING_TTL = 60
+
+
+class IdempotencyStore:
+    """Idempotency entries kept in the shared cache as (fingerprint, response or None)."""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, pending_ttl=IDEMPOTENCY_PENDING_TTL):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+
+    @staticmethod
+    def _key(key):
+        return 'idem:' + hashlib.sha256('\0'.join(key).encode()).hexdigest()
+
+    def begin(self, key, fingerprint):
+        """Reserve a key; returns None for a new request or the stored entry."""
+        cache_key = self._key(key)
+        for _ in range(2):
+            if cache.add(cache_key, (fingerprint, None), timeout=self.pending_ttl):
+                return None
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return entry
+            # Expired between add() and get(); try to take it again
+        return fingerprint, None
+
+    def complete(self, key, fingerprint, response):
+        cache.set(self._key(key), (fingerprint, response), timeout=self.ttl)
+
+    def abort(self, key):
+        cache.delete(self._key(key))
+
+
+store = IdempotencyStore()
+
+
+def idempotent(fn):
+    """Replay the stored response when a request repeats its Idempotency-Key.
+
+    Must sit under @jwt_required() so keys are scoped to the caller.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            return fn(*args, **kwargs)
+        key = (str(get_jwt_identity()), request.method, request.path, idempotency_key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        try:
+            entry = store.begin(key, fingerprint)
+        except Exception as e:
+            # Without the cache there is nothing to deduplicate against
+            print(f"[IDEMPOTENCY][ERROR] Lookup failed: {e}")
+            return fn(*args, **kwargs)
+        if entry is not None:
+            stored_fingerprint, stored = entry
+            if stored_fingerprint != fingerprint:
+                return jsonify({'success': False, 'error': 'Idempotency-Key was already used with a different request'}), 422
+            if stored is None:
+                return jsonify({'success': False, 'error': 'A request with this Idempotency-Key is still being processed'}), 409
+            body, status, mimetype = stored
+            response = make_response(body, status)
+            response.mimetype = mimetype
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(fn(*args, **kwargs))
+        except Exception:
+            store.abort(key)
+            raise
+        # Server errors are not remembered so the client can retry them
+        try:
+            if response.status_code >= 500:
+                store.abort(key)
+            else:
+                store.complete(key, fingerprint, (response.get_data(), response.status_code, response.mimetype))
+        except Exception as e:
+            # The request itself succeeded; only its replay is lost
+            print(f"[IDEMPOTENCY][ERROR] Store failed: {e}")
+        return response
+    return wrapper
@@ -0,0 +1,191 @@
+from collections import deque
+import json
+import threading
+import time
+import uuid
+from flask import Response
+from .models import db, ParkingLot
+
+# Live spot-change events per lot, served as Server-Sent Events.
+#
+# Every path that flips spots publishes the changed spots after its commit.
+# Each lot with listeners has one channel: a short backlog of numbered events
+# and a condition the listeners wait on. Publishing appends once and wakes
+# the waiters, so the cost does not grow with the number of idle connections
+# and there is no per-client queue. Each open stream does occupy the worker
+# thread serving it, so production runs gunicorn with gevent workers
+# (web_gevent.sh), where the threads and the condition waits are greenlets and
+# one worker holds thousands of connections. The threaded development server
+# (python app.py) is only fit for a handful of listeners.
+#
+# With EVENTS_BACKEND=redis, events are published to a Redis channel and a
+# single relay thread per process feeds them to the local channels, so a
+# booking on one worker (or a Celery task) reaches listeners on every worker.
+
+BACKLOG = 256
+HEARTBEAT_SECONDS = 15
+REDIS_CHANNEL = 'parking:lot-events'
+
+
+class LotChannel:
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.events = deque(maxlen=BACKLOG)  # (seq, json payload)
+        self.listeners = 0
+        self.cond = threading.Condition()
+
+    def event_id(self, seq):
+        return f'{self.epoch}-{seq}'
+
+    def resume_from(self, last_event_id):
+        """Sequence to resume after, or None when the events in between are gone."""
+        epoch, _, seq = (last_event_id or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self.events[0][0] if self.events else self.seq + 1
+        return seq if oldest <= seq + 1 <= self.seq + 1 else None
+
+    def wait(self, after, timeout):
+        """Events after `after`, blocking up to `timeout`; None if some were dropped."""
+        with self.cond:
+            if self.seq <= after:
+                self.cond.wait(timeout)
+            if self.events and self.events[0][0] > after + 1:
+                return None
+            return [(seq, data) for seq, data in self.events if seq > after]
+
+
+class Broker:
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, lot_id):
+        with self._lock:
+            channel = self._channels.get(lot_id)
+            if channel is None:
+                channel = self._channels[lot_id] = LotChannel()
+            channel.listeners += 1
+            return channel
+
+    def unsubscribe(self, lot_id, channel):
+        with self._lock:
+            channel.listeners -= 1
+            if channel.listeners <= 0 and self._channels.get(lot_id) is channel:
+                del self._channels[lot_id]
+
+    def dispatch(self, lot_id, data):
+        channel = self._channels.get(lot_id)
+        if channel is None:
+            return  # nobody is listening to this lot here
+        with channel.cond:
+            channel.seq += 1
+            channel.events.append((channel.seq, data))
+            channel.cond.notify_all()
+
+    def listener_count(self):
+        with self._lock:
+            return sum(channel.listeners for channel in self._channels.values())
+
+
+broker = Broker()
+_redis = None
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def _run_relay(url):
+    import redis
+    while True:
+        try:
+            pubsub = redis.Redis.from_url(url).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(REDIS_CHANNEL)
+            for message in pubsub.listen():
+                lot_id, _, data = message['data'].decode().partition(' ')
+                broker.dispatch(int(lot_id), data)
+        except Exception as e:
+            print(f"[EVENTS][ERROR] Relay disconnected: {e}")
+            time.sleep(1)
+
+
+def configure_events(app):
+    """Route published events through Redis when EVENTS_BACKEND is 'redis'."""
+    global _redis, _relay
+    if app.config.get('EVENTS_BACKEND', 'local') != 'redis':
+        return
+    import redis
+    url = app.config['EVENTS_REDIS_URL']
+    with _relay_lock:
+        if _redis is None:
+            _redis = redis.Redis.from_url(url)
+        if _relay is None:
+            _relay = threading.Thread(target=_run_relay, args=(url,), name='lot-events-relay', daemon=True)
+            _relay.start()
+
+
+def spot_event(spot_id, spot_number, status):
+    return {
+        'id': spot_id,
+        'spot_number': spot_number,
+        'status': status,
+        'is_occupied': status != 'A',
+        'is_available': status == 'A'
+    }
+
+
+def publish_spot_changes(lot_id, spots):
+    """Announce changed spots (dicts from spot_event) of a lot after commit."""
+    if not spots:
+        return
+    try:
+        # Read from the committed lot row, which every worker agrees on; an
+        # allocator only knows the claims made in its own process
+        available = db.session.query(
+            db.func.max(ParkingLot.number_of_spots - db.func.coalesce(ParkingLot.occupied, 0), 0)
+        ).filter(ParkingLot.id == lot_id).scalar()
+        data = json.dumps({'lot_id': lot_id, 'available_spots': available, 'spots': spots})
+        if _redis is not None:
+            _redis.publish(REDIS_CHANNEL, f'{lot_id} {data}')
+        else:
+            broker.dispatch(lot_id, data)
+    except Exception as e:
+        # Listeners resync on reconnect; a lost event must not fail the booking
+        print(f"[EVENTS][ERROR] Could not publish for lot {lot_id}: {e}")
+
+
+def stream_lot_events(lot_id, last_event_id=None):
+    """SSE response of spot changes for one lot.
+
+    Sends 'spots' events, and 'resync' when events were missed (reconnecting
+    too late, or falling behind the backlog) so the client refetches the lot.
+    """
+    def generate():
+        channel = broker.subscribe(lot_id)
+        try:
+            yield 'retry: 3000\n\n'
+            after = channel.resume_from(last_event_id) if last_event_id else channel.seq
+            if after is None:
+                after = channel.seq
+                yield f'id: {channel.event_id(after)}\nevent: resync\ndata: {{}}\n\n'
+            while True:
+                events = channel.wait(after, HEARTBEAT_SECONDS)
+                if events is None:
+                    after = channel.seq
+                    yield f'id: {channel.event_id(after)}\nevent: resync\ndata: {{}}\n\n'
+                elif events:
+                    for seq, data in events:
+                        yield f'id: {channel.event_id(seq)}\nevent: spots\ndata: {data}\n\n'
+                    after = events[-1][0]
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            broker.unsubscribe(lot_id, channel)
+
+    # No request context is kept for the stream, so the request's database
+    # session is closed as soon as the response starts
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,56 @@
+from sqlalchemy import func
+from .models import db, ParkingLot, Reservation, LotDailyRollup
+
+# Shared lot listing query for the admin and user dashboards. Occupancy comes
+# from the ParkingLot.occupied counter and reservation totals from grouped
+# analytics rollups (app/rollups.py) joined back to the lots, so listing
+# every lot is one round trip however many lots there are.
+
+
+def _reservation_counts():
+    # Completed totals come from the daily rollups, active ones from the
+    # partial index on open reservations; neither reads reservation history
+    completed = db.session.query(
+        LotDailyRollup.lot_id.label('lot_id'),
+        func.sum(LotDailyRollup.completed).label('completed'),
+        func.sum(LotDailyRollup.revenue).label('revenue')
+    ).group_by(LotDailyRollup.lot_id).subquery()
+    active = db.session.query(
+        Reservation.parking_lot_id.label('lot_id'),
+        func.count(Reservation.id).label('active')
+    ).filter(Reservation.leaving_timestamp.is_(None)).group_by(Reservation.parking_lot_id).subquery()
+    return completed, active
+
+
+def lot_summary_query(with_reservations=False):
+    """Query of ParkingLot rows with occupied and available (and optionally reservation) counts.
+
+    with_reservations adds reservations, active_reservations and revenue.
+
+    Callers add their own filters; rows come back ordered by lot id.
+    """
+    occupied = func.coalesce(ParkingLot.occupied, 0)
+    columns = [
+        ParkingLot,
+        occupied.label('occupied'),
+        func.max(ParkingLot.number_of_spots - occupied, 0).label('available'),
+    ]
+    if not with_reservations:
+        return db.session.query(*columns).order_by(ParkingLot.id)
+    completed, active = _reservation_counts()
+    active_count = func.coalesce(active.c.active, 0)
+    columns += [
+        (func.coalesce(completed.c.completed, 0) + active_count).label('reservations'),
+        active_count.label('active_reservations'),
+        func.coalesce(completed.c.revenue, 0.0).label('revenue'),
+    ]
+    return db.session.query(*columns).outerjoin(
+        completed, completed.c.lot_id == ParkingLot.id
+    ).outerjoin(
+        active, active.c.lot_id == ParkingLot.id
+    ).order_by(ParkingLot.id)
+
+
+def lot_summaries(*criteria, with_reservations=False):
+    """Summary rows for the lots matching `criteria` (all lots when none)."""
+    return lot_summary_query(with_reservations).filter(*criteria).all()
@@ -0,0 +1,234 @@
+from datetime import date, datetime
+import re
+from sqlalchemy import func, select, text
+from .models import db, ParkingSpot, Reservation, LotDailyRollup
+from .rollups import rebuild_rollups
+from .user_stats import rebuild_user_stats
+from .search import FTS_TABLES, fts_table_sql
+
+# Versioned schema migrations for live databases.
+#
+# db.create_all() only creates missing tables, so anything added to an
+# existing table (indexes, columns, triggers) is applied here instead. Each
+# migration runs once, in order, and is recorded in schema_migrations.
+# Migrations must also be safe on a fresh database where create_all() has
+# already built the current schema.
+
+
+def _create_index(name, table, columns):
+    return f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+
+
+def _add_column(conn, table, column, ddl):
+    columns = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _add_hot_path_indexes(conn):
+    conn.execute(text(_create_index('ix_parking_spots_lot_status', 'parking_spots', ['lot_id', 'status'])))
+    conn.execute(text(_create_index('ix_reservations_vehicle_leaving', 'reservations', ['vehicle_number', 'leaving_timestamp'])))
+    conn.execute(text(_create_index('ix_reservations_user_parking', 'reservations', ['user_id', 'parking_timestamp'])))
+    conn.execute(text(_create_index('ix_reservations_lot', 'reservations', ['parking_lot_id'])))
+
+
+def _add_lot_floors(conn):
+    _add_column(conn, 'parking_lots', 'floors', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def _add_lot_tariff(conn):
+    _add_column(conn, 'parking_lots', 'tariff', 'TEXT')
+
+
+def _add_record_listing_indexes(conn):
+    # (parking_lot_id, parking_timestamp) also serves plain parking_lot_id lookups
+    conn.execute(text(_create_index('ix_reservations_lot_parking', 'reservations', ['parking_lot_id', 'parking_timestamp'])))
+    conn.execute(text(_create_index('ix_reservations_parking', 'reservations', ['parking_timestamp'])))
+    conn.execute(text("DROP INDEX IF EXISTS ix_reservations_lot"))
+
+
+def _add_history_version(conn):
+    _add_column(conn, 'users', 'history_version', 'INTEGER NOT NULL DEFAULT 0')
+    bump = "UPDATE users SET history_version = history_version + 1 WHERE id = {row}.user_id;"
+    for event, rows in (('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']), ('DELETE', ['OLD'])):
+        body = ' '.join(bump.format(row=row) for row in rows)
+        conn.execute(text(f"DROP TRIGGER IF EXISTS trg_reservations_history_{event.lower()}"))
+        conn.execute(text(
+            f"CREATE TRIGGER trg_reservations_history_{event.lower()} AFTER {event} ON reservations "
+            f"BEGIN {body} END"
+        ))
+
+
+def _add_analytics_rollups(conn):
+    # The rollup tables themselves come from create_all(); fill them from history
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_reservations_active_lot ON reservations (parking_lot_id) "
+        "WHERE leaving_timestamp IS NULL"
+    ))
+    rebuild_rollups(conn=conn)
+
+
+def _add_user_stats(conn):
+    # The projection tables come from create_all(); fill them from history
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_reservations_active_user ON reservations (user_id) "
+        "WHERE leaving_timestamp IS NULL"
+    ))
+    rebuild_user_stats(conn=conn)
+
+
+def _add_search_indexes(conn):
+    for name in FTS_TABLES:
+        for statement in fts_table_sql(name):
+            conn.execute(text(statement))
+
+
+def _add_lot_coordinates(conn):
+    _add_column(conn, 'parking_lots', 'latitude', 'FLOAT')
+    _add_column(conn, 'parking_lots', 'longitude', 'FLOAT')
+
+
+def _add_spot_versions(conn):
+    _add_column(conn, 'parking_lots', 'spot_version', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'parking_lots', 'spot_reset_version', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'parking_spots', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute(text(_create_index('ix_parking_spots_lot_version', 'parking_spots', ['lot_id', 'version'])))
+    bump = "UPDATE parking_lots SET spot_version = spot_version + 1{extra} WHERE id = {row}.lot_id;"
+    stamp = (
+        "UPDATE parking_spots SET version = "
+        "(SELECT spot_version FROM parking_lots WHERE id = NEW.lot_id) WHERE id = NEW.id;"
+    )
+    triggers = {
+        'insert': ("AFTER INSERT ON parking_spots", bump.format(extra='', row='NEW') + ' ' + stamp),
+        'update': (
+            "AFTER UPDATE OF status, floor ON parking_spots "
+            "WHEN OLD.status IS NOT NEW.status OR OLD.floor IS NOT NEW.floor",
+            bump.format(extra='', row='NEW') + ' ' + stamp
+        ),
+        # Deletions have no row left to carry them, so deltas across one are refused
+        'delete': (
+            "AFTER DELETE ON parking_spots",
+            bump.format(extra=', spot_reset_version = spot_version + 1', row='OLD')
+        ),
+    }
+    for event, (when, body) in triggers.items():
+        conn.execute(text(f"DROP TRIGGER IF EXISTS trg_parking_spots_version_{event}"))
+        conn.execute(text(f"CREATE TRIGGER trg_parking_spots_version_{event} {when} BEGIN {body} END"))
+
+
+MIGRATIONS = [
+    (1, 'hot path indexes', _add_hot_path_indexes),
+    (2, 'parking lot floors', _add_lot_floors),
+    (3, 'parking lot tariffs', _add_lot_tariff),
+    (4, 'parking record listing indexes', _add_record_listing_indexes),
+    (5, 'user history version', _add_history_version),
+    (6, 'analytics rollups', _add_analytics_rollups),
+    (7, 'user statistics', _add_user_stats),
+    (8, 'full-text search', _add_search_indexes),
+    (9, 'parking lot coordinates', _add_lot_coordinates),
+    (10, 'spot versions', _add_spot_versions),
+]
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at DATETIME NOT NULL)"
+    ))
+
+
+def current_version():
+    with db.engine.begin() as conn:
+        _ensure_migrations_table(conn)
+        return conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar() or 0
+
+
+def upgrade():
+    """Apply pending migrations; returns the list of versions applied."""
+    applied = []
+    with db.engine.begin() as conn:
+        _ensure_migrations_table(conn)
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {'v': version, 'n': name, 't': datetime.utcnow()}
+            )
+            applied.append(version)
+    return applied
+
+
+def _open_per_lot():
+    return select(func.count(Reservation.id).label('active')).where(
+        Reservation.leaving_timestamp.is_(None)
+    ).group_by(Reservation.parking_lot_id).subquery()
+
+
+# Query shapes that run on every booking or dashboard load, each with the
+# index that must answer it; check_query_plans() reports any that do not.
+def hot_queries():
+    return {
+        'active reservation by vehicle': ('ix_reservations_vehicle_leaving', select(Reservation.id).where(
+            Reservation.vehicle_number == 'KA01AB1234',
+            Reservation.leaving_timestamp.is_(None)
+        )),
+        'user reservations by time': ('ix_reservations_user_parking', select(Reservation.id).where(
+            Reservation.user_id == 1
+        ).order_by(Reservation.parking_timestamp.desc())),
+        'user history page': ('ix_reservations_user_parking', select(Reservation.id).where(
+            Reservation.user_id == 1
+        ).order_by(Reservation.parking_timestamp.desc(), Reservation.id.desc()).limit(100)),
+        'lot reservations': ('ix_reservations_lot_parking', select(Reservation.id).where(
+            Reservation.parking_lot_id == 1
+        )),
+        'parking records page': ('ix_reservations_parking', select(Reservation.id).order_by(
+            Reservation.parking_timestamp.desc(), Reservation.id.desc()
+        ).limit(100)),
+        'lot parking records page': ('ix_reservations_lot_parking', select(Reservation.id).where(
+            Reservation.parking_lot_id == 1
+        ).order_by(Reservation.parking_timestamp.desc(), Reservation.id.desc()).limit(100)),
+        'user active reservations': ('ix_reservations_active_user', select(func.count(Reservation.id)).where(
+            Reservation.user_id == 1, Reservation.leaving_timestamp.is_(None)
+        )),
+        'active reservations': ('ix_reservations_active_lot', select(func.sum(_open_per_lot().c.active))),
+        'rollups for a year': ('ix_lot_rollups_daily_bucket', select(LotDailyRollup.completed).where(
+            LotDailyRollup.bucket >= date(2025, 1, 1), LotDailyRollup.bucket < date(2026, 1, 1)
+        )),
+        'lot spot changes': ('ix_parking_spots_lot_version', select(ParkingSpot.id).where(
+            ParkingSpot.lot_id == 1,
+            ParkingSpot.version > 10
+        )),
+        'free spot in lot': ('ix_parking_spots_lot_status', select(ParkingSpot.id).where(
+            ParkingSpot.lot_id == 1,
+            ParkingSpot.status == 'A'
+        )),
+    }
+
+
+# A plan step reading a table, and the index it goes through if any
+_TABLE_STEP = re.compile(r'^(?:SCAN|SEARCH) (\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+
+
+def explain(statement):
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    with db.engine.connect() as conn:
+        return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+
+def check_query_plans():
+    """Return {name: plan} for every hot query not answered from its index.
+
+    Every step that reads a table must go through the query's expected index,
+    so walking some other index end to end counts as a failure too.
+    """
+    tables = set(db.metadata.tables)
+    failures = {}
+    for name, (index, statement) in hot_queries().items():
+        plan = explain(statement)
+        steps = [m.groups() for m in map(_TABLE_STEP.match, plan) if m and m.group(1) in tables]
+        if not steps or any(used != index for _, used in steps):
+            failures[name] = plan
+    return failures
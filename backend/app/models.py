@@ -19,6 +19,8 @@ class User(db.Model):
     role = db.Column(db.String(10), nullable=False, default='user')  # 'admin' or 'user'
     flagged = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped by triggers on every change to the user's reservations (history ETag)
+    history_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     reservations = db.relationship('Reservation', back_populates='user', cascade='all, delete-orphan')
 
@@ -40,10 +42,18 @@ class ParkingLot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     prime_location_name = db.Column(db.String(100), nullable=False)
     price = db.Column(db.Float, nullable=False)  # price per hour
+    tariff = db.Column(db.Text, nullable=True)  # JSON tariff rules, see app/pricing.py
     address = db.Column(db.String(200), nullable=False)
     pin_code = db.Column(db.String(10), nullable=False)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
     number_of_spots = db.Column(db.Integer, nullable=False)
+    floors = db.Column(db.Integer, nullable=False, default=1)
     occupied = db.Column(db.Integer, default=0)  # Number of occupied spots
+    # Bumped by triggers on every spot change; spots removed at spot_reset_version
+    # or later cannot be expressed as a delta (see app/spot_sync.py)
+    spot_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    spot_reset_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     spots = db.relationship('ParkingSpot', back_populates='lot', cascade='all, delete-orphan')
@@ -58,10 +68,11 @@ class ParkingSpot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lots.id'), nullable=False)
     spot_number = db.Column(db.Integer, nullable=False)  
-    status = db.Column(db.String(1), nullable=False, default='A')  # 'A' = Available, 'O' = Occupied
+    status = db.Column(db.String(1), nullable=False, default='A')  # 'A' = Available, 'O' = Occupied, 'H' = Held
     is_occupied = db.Column(db.Boolean, default=False)  
     floor = db.Column(db.Integer, default=1)  # Floor number
     current_reservation_id = db.Column(db.Integer, db.ForeignKey('reservations.id'), nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # lot spot_version of its last change
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     lot = db.relationship('ParkingLot', back_populates='spots')
@@ -79,6 +90,8 @@ class ParkingSpot(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('lot_id', 'spot_number', name='unique_spot_per_lot'),
+        db.Index('ix_parking_spots_lot_status', 'lot_id', 'status'),
+        db.Index('ix_parking_spots_lot_version', 'lot_id', 'version'),
     )
 
     def __repr__(self):
@@ -108,5 +121,83 @@ class Reservation(db.Model):
     )
     lot = db.relationship('ParkingLot', foreign_keys=[parking_lot_id])
 
+    __table_args__ = (
+        db.Index('ix_reservations_vehicle_leaving', 'vehicle_number', 'leaving_timestamp'),
+        db.Index('ix_reservations_user_parking', 'user_id', 'parking_timestamp'),
+        db.Index('ix_reservations_lot_parking', 'parking_lot_id', 'parking_timestamp'),
+        db.Index('ix_reservations_parking', 'parking_timestamp'),
+        db.Index('ix_reservations_active_lot', 'parking_lot_id', sqlite_where=db.text('leaving_timestamp IS NULL')),
+        db.Index('ix_reservations_active_user', 'user_id', sqlite_where=db.text('leaving_timestamp IS NULL')),
+    )
+
     def __repr__(self):
         return f'<Reservation User:{self.user_id} Spot:{self.spot_id}>'
+
+
+# --- SpotHold Model ---
+class SpotHold(db.Model):
+    __tablename__ = 'spot_holds'
+    id = db.Column(db.Integer, primary_key=True)
+    spot_id = db.Column(db.Integer, db.ForeignKey('parking_spots.id'), nullable=False)
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lots.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    vehicle_number = db.Column(db.String(20), nullable=False)
+    phone_number = db.Column(db.String(20), nullable=True)
+    customer_name = db.Column(db.String(100), nullable=True)
+    remarks = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Held')  # 'Held', 'Confirmed', 'Cancelled' or 'Expired'
+    reservation_id = db.Column(db.Integer, db.ForeignKey('reservations.id'), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_spot_holds_status_expires', 'status', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<SpotHold Spot:{self.spot_id} {self.status}>'
+
+
+# --- Analytics rollups (see app/rollups.py) ---
+class LotHourlyRollup(db.Model):
+    __tablename__ = 'lot_rollups_hourly'
+    lot_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)  # start of the parking hour
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    occupied_hours = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_lot_rollups_hourly_bucket', 'bucket'),
+    )
+
+
+class LotDailyRollup(db.Model):
+    __tablename__ = 'lot_rollups_daily'
+    lot_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Date, primary_key=True)  # parking date
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    occupied_hours = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_lot_rollups_daily_bucket', 'bucket'),
+    )
+
+
+# --- Per-user statistics projection (see app/user_stats.py) ---
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0.0)
+    hours = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class UserMonthlyStats(db.Model):
+    __tablename__ = 'user_monthly_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM' of the parking time
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0.0)
+    hours = db.Column(db.Float, nullable=False, default=0.0)
@@ -0,0 +1,48 @@
+from sqlalchemy import update, select, func
+from .models import db, ParkingLot, ParkingSpot
+
+# ParkingLot.occupied is maintained as a counter: every write path that flips
+# a spot adjusts it by a delta in the same transaction. The reconcile task in
+# app/tasks/occupancy.py repairs any drift against the parking_spots rows.
+
+
+def adjust_occupied(lot_id, delta):
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(occupied=func.coalesce(ParkingLot.occupied, 0) + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _actual_occupied():
+    return (
+        select(func.count(ParkingSpot.id))
+        .where(ParkingSpot.lot_id == ParkingLot.id, ParkingSpot.is_occupied == True)
+        .correlate(ParkingLot)
+        .scalar_subquery()
+    )
+
+
+def reconcile_occupied():
+    """Repair lots whose counter disagrees with parking_spots.
+
+    Returns {lot_id: (counter, actual)} for every lot that drifted.
+    """
+    actual = _actual_occupied()
+    drifted = {
+        lot_id: (counter, count)
+        for lot_id, counter, count in db.session.query(
+            ParkingLot.id, ParkingLot.occupied, actual
+        ).filter(func.coalesce(ParkingLot.occupied, -1) != actual).all()
+    }
+    if drifted:
+        # Recount inside the UPDATE so bookings made since the check are not lost
+        db.session.execute(
+            update(ParkingLot)
+            .where(ParkingLot.id.in_(drifted))
+            .values(occupied=_actual_occupied())
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return drifted
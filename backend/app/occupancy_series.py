@@ -0,0 +1,255 @@
+from array import array
+import atexit
+import os
+import struct
+import threading
+import time
+import numpy as np
+from sqlalchemy.engine import make_url
+from .models import db, ParkingLot
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, one sampler per process
+    fcntl = None
+
+# Occupancy time series.
+#
+# A sampler thread in the web process reads every lot's occupied counter at a
+# fixed interval and writes it into a per-lot ring buffer of unsigned 16-bit
+# ints, one slot per interval, so a week at one-minute resolution is ~20KB per
+# lot and timestamps never need storing (slot = tick % capacity). Slots with no
+# sample hold MISSING. Rings are flushed to <directory>/<lot_id>.ring every
+# few samples and reloaded on start. The directory is OCCUPANCY_DIR, or an
+# 'occupancy' directory next to the SQLite database, so an app built on
+# another database never touches these files.
+#
+# Every web worker starts a sampler, but only the one holding the directory's
+# lock file samples and writes; the others reload the rings from disk each
+# interval (so they trail by up to a flush) and take over if the lock frees.
+
+MISSING = 0xFFFF
+_HEADER = struct.Struct('<4sIIq')  # magic, interval, capacity, last tick
+_MAGIC = b'OCC1'
+
+
+class OccupancyRing:
+    def __init__(self, capacity, last_tick=None, values=None):
+        self.capacity = capacity
+        self.last_tick = last_tick
+        self.values = values if values is not None else array('H', [MISSING]) * capacity
+
+    def record(self, tick, occupied):
+        if self.last_tick is not None and tick <= self.last_tick - self.capacity:
+            return
+        if self.last_tick is not None and tick > self.last_tick + 1:
+            # Mark the ticks skipped since the last sample (sampler paused or restarted)
+            gap = min(tick - self.last_tick - 1, self.capacity)
+            for missed in range(tick - gap, tick):
+                self.values[missed % self.capacity] = MISSING
+        self.values[tick % self.capacity] = min(max(occupied, 0), MISSING - 1)
+        if self.last_tick is None or tick > self.last_tick:
+            self.last_tick = tick
+
+    def window(self, first_tick, last_tick):
+        """Samples for ticks first_tick..last_tick as a float array, NaN where missing."""
+        ticks = np.arange(first_tick, last_tick + 1, dtype=np.int64)
+        if self.last_tick is None:
+            return np.full(len(ticks), np.nan)
+        samples = np.frombuffer(self.values, dtype=np.uint16)[ticks % self.capacity].astype(float)
+        # Ticks outside what the ring still holds are unknown
+        held = (ticks <= self.last_tick) & (ticks > self.last_tick - self.capacity)
+        samples[~held | (samples == MISSING)] = np.nan
+        return samples
+
+
+class OccupancyStore:
+    def __init__(self, interval=60, capacity=7 * 24 * 60, directory=None):
+        self.interval = interval
+        self.capacity = capacity
+        self.directory = directory
+        self.rings = {}
+        self._lock = threading.Lock()
+        self._writer_lock = None
+
+    def tick(self, now=None):
+        return int((time.time() if now is None else now) // self.interval)
+
+    def record(self, counts, now=None):
+        """Record {lot_id: occupied} for the current interval."""
+        tick = self.tick(now)
+        with self._lock:
+            for lot_id, occupied in counts.items():
+                ring = self.rings.get(lot_id)
+                if ring is None:
+                    ring = self.rings[lot_id] = OccupancyRing(self.capacity)
+                ring.record(tick, occupied)
+            # Lots deleted since the last sample stop being tracked here;
+            # their files go with the lot (discard)
+            for lot_id in set(self.rings) - set(counts):
+                del self.rings[lot_id]
+
+    def discard(self, lot_id):
+        """Forget a deleted lot's samples, on disk too."""
+        with self._lock:
+            self.rings.pop(lot_id, None)
+        self._remove(lot_id)
+
+    def series(self, lot_id, start, end, points, now=None):
+        """Downsample [start, end] (epoch seconds) to at most `points` buckets.
+
+        The range is clipped to what the rings can hold (the last `capacity`
+        intervals up to now). Returns (bucket_seconds, [(bucket_start, mean,
+        max), ...]) with None for buckets without samples.
+        """
+        if start > end:
+            raise ValueError('start must not be after end')
+        current = self.tick(now)
+        first = max(self.tick(start), current - self.capacity + 1)
+        last = min(self.tick(end), current)
+        if first > last:
+            return self.interval, []
+        with self._lock:
+            ring = self.rings.get(lot_id)
+            samples = ring.window(first, last) if ring else np.full(last - first + 1, np.nan)
+        per_bucket = max(-(-len(samples) // points), 1)
+        padded = np.full(-(-len(samples) // per_bucket) * per_bucket, np.nan)
+        padded[:len(samples)] = samples
+        buckets = padded.reshape(-1, per_bucket)
+        counts = np.sum(~np.isnan(buckets), axis=1)
+        sums = np.nansum(buckets, axis=1)
+        maxima = np.max(np.where(np.isnan(buckets), -1, buckets), axis=1)
+        result = []
+        for i in range(len(buckets)):
+            bucket_start = (first + i * per_bucket) * self.interval
+            if counts[i]:
+                result.append((bucket_start, round(float(sums[i] / counts[i]), 2), int(maxima[i])))
+            else:
+                result.append((bucket_start, None, None))
+        return per_bucket * self.interval, result
+
+    def _path(self, lot_id):
+        return os.path.join(self.directory, f'{lot_id}.ring')
+
+    def _remove(self, lot_id):
+        if self.directory and os.path.exists(self._path(lot_id)):
+            os.remove(self._path(lot_id))
+
+    def flush(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            snapshot = [(lot_id, ring.last_tick, ring.values.tobytes()) for lot_id, ring in self.rings.items()]
+        for lot_id, last_tick, values in snapshot:
+            if last_tick is None:
+                continue
+            tmp = self._path(lot_id) + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, self.interval, self.capacity, last_tick))
+                f.write(values)
+            os.replace(tmp, self._path(lot_id))
+
+    def load(self):
+        """Replace the rings with the ones flushed to the directory."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        rings = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.ring'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    magic, interval, capacity, last_tick = _HEADER.unpack(f.read(_HEADER.size))
+                    if (magic, interval, capacity) != (_MAGIC, self.interval, self.capacity):
+                        continue  # written with other settings; start over
+                    values = array('H')
+                    values.frombytes(f.read(capacity * values.itemsize))
+                if len(values) == capacity:
+                    rings[int(name[:-5])] = OccupancyRing(capacity, last_tick, values)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"[OCCUPANCY][ERROR] Could not load {name}: {e}")
+        with self._lock:
+            self.rings = rings
+
+    def acquire_writer(self):
+        """Try to become the one process sampling into the directory."""
+        if not self.directory or fcntl is None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        handle = open(os.path.join(self.directory, '.writer.lock'), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._writer_lock = handle  # held (and the lock with it) for the process lifetime
+        return True
+
+
+store = None
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _sample(app):
+    with app.app_context():
+        counts = dict(db.session.query(ParkingLot.id, ParkingLot.occupied).all())
+        db.session.remove()
+    store.record({lot_id: occupied or 0 for lot_id, occupied in counts.items()})
+
+
+def _run_sampler(app, flush_every):
+    samples = 0
+    writer = False
+    while True:
+        try:
+            if not writer:
+                writer = store.acquire_writer()
+                if writer:
+                    atexit.register(store.flush)
+                    store.load()
+            if writer:
+                _sample(app)
+                samples += 1
+                if samples % flush_every == 0:
+                    store.flush()
+            else:
+                store.load()
+        except Exception as e:
+            print(f"[OCCUPANCY][ERROR] Sampling failed: {e}")
+        time.sleep(store.interval - time.time() % store.interval)
+
+
+def occupancy_dir(app):
+    """Where the rings of this app's database live; None keeps them in memory."""
+    if app.config.get('OCCUPANCY_DIR'):
+        return app.config['OCCUPANCY_DIR']
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    # Flask-SQLAlchemy resolves relative SQLite paths against the instance folder
+    path = os.path.join(app.instance_path, url.database)
+    return os.path.join(os.path.dirname(path), 'occupancy')
+
+
+def discard_lot_series(lot_id):
+    if store is not None:
+        store.discard(lot_id)
+
+
+def start_sampler(app):
+    """Start sampling in this process (once); later calls are no-ops."""
+    global store, _sampler
+    interval = app.config.get('OCCUPANCY_SAMPLE_SECONDS', 60)
+    if not interval or _sampler is not None:
+        return
+    with _sampler_lock:
+        if _sampler is not None:
+            return
+        retention = app.config.get('OCCUPANCY_RETENTION_HOURS', 7 * 24)
+        store = OccupancyStore(interval, max(int(retention * 3600 // interval), 1), occupancy_dir(app))
+        store.load()
+        _sampler = threading.Thread(target=_run_sampler, args=(app, app.config.get('OCCUPANCY_FLUSH_SAMPLES', 5)),
+                                    name='occupancy-sampler', daemon=True)
+        _sampler.start()
@@ -0,0 +1,90 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+# Keyset (cursor) pagination over (timestamp, id) in descending order. The
+# cursor is the position of the last row served, so every page is an index
+# range scan no matter how deep the client pages.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        raise ValueError('limit must be a number')
+    return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def keyset_page(query, timestamp_column, id_column, cursor, limit):
+    """Return (rows, next_cursor) for the page after `cursor`, newest first."""
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(timestamp_column, id_column) < tuple_(timestamp, row_id))
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
+
+
+def keyset_chunks(query, timestamp_column, id_column, cursor=None, chunk_size=DEFAULT_PAGE_SIZE):
+    """Yield every row after `cursor`, newest first, fetching chunk_size rows per query.
+
+    Each chunk is its own short query rather than one long-lived cursor, so a
+    full dump neither holds rows in memory nor keeps SQLite's read lock (which
+    would block bookings) for the length of the download.
+    """
+    while True:
+        rows, cursor = keyset_page(query, timestamp_column, id_column, cursor, chunk_size)
+        yield from rows
+        if cursor is None:
+            return
+
+
+def sorted_page(query, sort_column, sort_key, id_column, cursor, limit, descending=False, parse=None):
+    """Keyset page ordered by an arbitrary column (or expression labelled sort_key), then id.
+
+    The cursor carries the last row's sort value and id; `parse` turns the
+    JSON-decoded value back into what the column compares against.
+    """
+    if cursor:
+        try:
+            value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if parse is not None:
+                value = parse(value)
+        except Exception:
+            raise ValueError('Invalid cursor')
+        after = tuple_(sort_column, id_column) < tuple_(value, row_id) if descending \
+            else tuple_(sort_column, id_column) > tuple_(value, row_id)
+        query = query.filter(after)
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        raw = json.dumps([getattr(last, sort_key), getattr(last, id_column.key)], default=str)
+        next_cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+    return rows, next_cursor
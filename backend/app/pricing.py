@@ -0,0 +1,131 @@
+import json
+import math
+import numpy as np
+
+# Parking cost calculation shared by every checkout path.
+#
+# A lot is billed at its hourly price unless it has a tariff (stored as JSON
+# on ParkingLot.tariff) with any of:
+#   first_hour   flat charge for the first hour (also the minimum charge)
+#   night_rate   hourly rate between night_start and night_end (hours 0-23)
+#   daily_cap    most a stay can cost per started 24 hours
+# Costs are computed with NumPy over arrays of start/end times, so pricing one
+# checkout and re-pricing millions of reservations use the same code.
+
+TARIFF_FIELDS = ('first_hour', 'night_rate', 'night_start', 'night_end', 'daily_cap')
+HOUR_US = 3600 * 10**6
+DAY_US = 24 * HOUR_US
+
+
+def parse_rate(value, field):
+    """A non-negative, finite amount from a request (NaN would poison every cost)."""
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f'{field} must be a finite number')
+    if value < 0:
+        raise ValueError(f'{field} cannot be negative')
+    return value
+
+
+def parse_tariff(data):
+    """Validate tariff settings from a request; returns the JSON to store or None."""
+    if not data:
+        return None
+    if not isinstance(data, dict):
+        raise ValueError('Tariff must be an object')
+    unknown = set(data) - set(TARIFF_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown tariff fields: {', '.join(sorted(unknown))}")
+    tariff = {}
+    for field in ('first_hour', 'night_rate', 'daily_cap'):
+        if data.get(field) is not None:
+            tariff[field] = parse_rate(data[field], field)
+    if 'night_rate' in tariff:
+        for field, default in (('night_start', 22), ('night_end', 6)):
+            value = int(data.get(field, default))
+            if not 0 <= value <= 23:
+                raise ValueError(f'{field} must be an hour between 0 and 23')
+            tariff[field] = value
+    return json.dumps(tariff, sort_keys=True) if tariff else None
+
+
+class Tariff:
+    def __init__(self, hourly_rate, first_hour=None, night_rate=None, night_start=22, night_end=6, daily_cap=None):
+        self.hourly_rate = hourly_rate
+        self.first_hour = first_hour
+        self.night_rate = night_rate
+        self.night_start = night_start * HOUR_US
+        self.night_end = night_end * HOUR_US
+        self.daily_cap = daily_cap
+
+    @classmethod
+    def from_lot(cls, price, tariff_json=None):
+        return cls(price, **json.loads(tariff_json)) if tariff_json else cls(price)
+
+    def _night_until(self, micros):
+        # Night microseconds from the epoch up to each timestamp
+        days, offset = np.divmod(micros, DAY_US)
+        start, end = self.night_start, self.night_end
+        if start > end:
+            per_day = end + (DAY_US - start)
+            in_day = np.minimum(offset, end) + np.maximum(offset - start, 0)
+        else:
+            per_day = end - start
+            in_day = np.clip(offset - start, 0, per_day)
+        return days * per_day + in_day
+
+    def _metered(self, starts, ends):
+        hours = (ends - starts) / 10**6 / 3600
+        if self.night_rate is None:
+            return hours * self.hourly_rate
+        night_hours = (self._night_until(ends) - self._night_until(starts)) / HOUR_US
+        return (hours - night_hours) * self.hourly_rate + night_hours * self.night_rate
+
+    def costs(self, starts, ends):
+        """Vectorized (duration_hours, cost) for arrays of start and end datetimes."""
+        starts = _epoch_micros(starts)
+        ends = _epoch_micros(ends)
+        hours = (ends - starts) / 10**6 / 3600
+        costs = self._metered(starts, ends)
+        if self.first_hour is not None:
+            first_end = np.minimum(ends, starts + HOUR_US)
+            costs = costs - self._metered(starts, first_end) + self.first_hour
+        if self.daily_cap is not None:
+            days = np.maximum(np.ceil(hours / 24), 1)
+            costs = np.minimum(costs, days * self.daily_cap)
+        return hours, np.round(costs, 2)
+
+    def cost(self, start, end):
+        """(duration_hours, cost) for a single stay."""
+        hours, costs = self.costs([start], [end])
+        return float(hours[0]), float(costs[0])
+
+
+def _epoch_micros(values):
+    # Naive local datetimes -> int64 microseconds; time-of-day is kept as written
+    return np.asarray(values, dtype='datetime64[us]').astype(np.int64)
+
+
+def parking_cost(parking_timestamp, leaving_timestamp, price_per_hour, tariff_json=None):
+    """Return (duration_hours, cost) for a stay at a lot."""
+    return Tariff.from_lot(price_per_hour, tariff_json).cost(parking_timestamp, leaving_timestamp)
+
+
+def price_reservations(lot_ids, prices, tariffs, starts, ends):
+    """Vectorized pricing of many reservations across lots.
+
+    All arguments are parallel sequences; reservations are grouped by lot so
+    each lot's tariff is applied to its rows in a single NumPy pass. Returns
+    (duration_hours, costs) arrays in input order.
+    """
+    lot_ids = np.asarray(lot_ids)
+    starts = np.asarray(starts, dtype='datetime64[us]')
+    ends = np.asarray(ends, dtype='datetime64[us]')
+    hours = np.zeros(len(lot_ids))
+    costs = np.zeros(len(lot_ids))
+    unique_lots, first_index = np.unique(lot_ids, return_index=True)
+    for lot_id, index in zip(unique_lots, first_index):
+        mask = lot_ids == lot_id
+        tariff = Tariff.from_lot(prices[index], tariffs[index])
+        hours[mask], costs[mask] = tariff.costs(starts[mask], ends[mask])
+    return hours, costs
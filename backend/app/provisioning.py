@@ -0,0 +1,88 @@
+import math
+from sqlalchemy import insert, delete, update, func
+from .models import db, ParkingSpot
+
+# Bulk creation and removal of parking spot rows. Spots are written with
+# executemany inserts in chunks instead of one ORM object per spot.
+
+INSERT_CHUNK_SIZE = 1000
+
+
+def spots_per_floor(number_of_spots, floors):
+    return max(math.ceil(number_of_spots / max(floors or 1, 1)), 1)
+
+
+def add_spots(lot_id, first_number, count, per_floor):
+    """Insert `count` free spots numbered from `first_number`."""
+    for start in range(first_number, first_number + count, INSERT_CHUNK_SIZE):
+        end = min(start + INSERT_CHUNK_SIZE, first_number + count)
+        db.session.execute(insert(ParkingSpot), [
+            {
+                'lot_id': lot_id,
+                'spot_number': number,
+                'status': 'A',
+                'is_occupied': False,
+                'floor': (number - 1) // per_floor + 1
+            }
+            for number in range(start, end)
+        ])
+
+
+def remove_free_spots(lot_id, count):
+    """Delete the `count` highest-numbered free spots of a lot.
+
+    Occupied spots are never removed; returns False (and removes nothing)
+    when the lot does not have enough free spots.
+    """
+    spot_ids = [row[0] for row in db.session.query(ParkingSpot.id).filter(
+        ParkingSpot.lot_id == lot_id,
+        ParkingSpot.status == 'A'
+    ).order_by(ParkingSpot.spot_number.desc()).limit(count).all()]
+    if len(spot_ids) < count:
+        return False
+    removed = 0
+    for start in range(0, len(spot_ids), INSERT_CHUNK_SIZE):
+        result = db.session.execute(
+            delete(ParkingSpot)
+            .where(ParkingSpot.id.in_(spot_ids[start:start + INSERT_CHUNK_SIZE]), ParkingSpot.status == 'A')
+            .execution_options(synchronize_session=False)
+        )
+        removed += result.rowcount
+    # A spot may have been booked between the select and the delete
+    return removed == count
+
+
+def assign_floors(lot_id, per_floor, floors):
+    """Set each free spot's floor from its spot number, capped at the top floor.
+
+    Occupied and held spots keep their floor, so nobody's car moves floors
+    mid-stay; they pick up the new layout at the next resize after they free up.
+    """
+    floor = func.min((ParkingSpot.spot_number - 1) // per_floor + 1, floors)
+    db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A', ParkingSpot.floor.is_distinct_from(floor))
+        .values(floor=floor)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def resize_lot(lot, number_of_spots, floors=None):
+    """Grow or shrink a lot's spot rows to `number_of_spots`; False if it cannot shrink."""
+    current = db.session.query(func.count(ParkingSpot.id)).filter(ParkingSpot.lot_id == lot.id).scalar()
+    floors = floors or lot.floors or 1
+    per_floor = spots_per_floor(number_of_spots, floors)
+    if number_of_spots > current:
+        last_number = db.session.query(func.max(ParkingSpot.spot_number)).filter(
+            ParkingSpot.lot_id == lot.id
+        ).scalar() or 0
+        add_spots(lot.id, last_number + 1, number_of_spots - current, per_floor)
+    elif number_of_spots < current:
+        if not remove_free_spots(lot.id, current - number_of_spots):
+            return False
+    if number_of_spots != current or floors != (lot.floors or 1):
+        # Floors follow the lot's current size, so existing spots move too
+        assign_floors(lot.id, per_floor, floors)
+    lot.number_of_spots = number_of_spots
+    lot.floors = floors
+    return True
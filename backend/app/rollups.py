@@ -0,0 +1,104 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, text
+from sqlalchemy.dialects.sqlite import insert
+from .models import db, LotHourlyRollup, LotDailyRollup
+
+# Per-lot analytics rollups. Every completed reservation adds its count,
+# revenue and occupied hours to the hour and day it was parked in, inside the
+# checkout transaction, so the dashboards aggregate a few rows per lot and day
+# instead of the whole reservations table. Anything that rewrites history in
+# bulk (backfill, repricing) rebuilds the affected range from reservations.
+
+# SQLAlchemy stores DateTime as 'YYYY-MM-DD HH:MM:SS.ffffff' and Date as
+# 'YYYY-MM-DD' on SQLite; rebuilt buckets must use the same text or they
+# would not compare (or conflict) with buckets written from Python.
+_HOUR_SQL = "strftime('%Y-%m-%d %H:00:00.000000', parking_timestamp)"
+_DAY_SQL = "date(parking_timestamp)"
+
+
+def _upsert(model, totals):
+    if not totals:
+        return
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[model.lot_id, model.bucket],
+        set_={
+            'completed': model.completed + stmt.excluded.completed,
+            'revenue': model.revenue + stmt.excluded.revenue,
+            'occupied_hours': model.occupied_hours + stmt.excluded.occupied_hours,
+        }
+    )
+    db.session.execute(stmt, [
+        {'lot_id': lot_id, 'bucket': bucket, 'completed': completed, 'revenue': revenue, 'occupied_hours': hours}
+        for (lot_id, bucket), (completed, revenue, hours) in totals.items()
+    ])
+
+
+def record_completions(items):
+    """Add completed reservations to the rollups in the caller's transaction.
+
+    Items are dicts with lot_id, parking_timestamp, duration_hours and cost.
+    """
+    hourly = defaultdict(lambda: [0, 0.0, 0.0])
+    daily = defaultdict(lambda: [0, 0.0, 0.0])
+    for item in items:
+        parked = item['parking_timestamp']
+        for totals, bucket in ((hourly, parked.replace(minute=0, second=0, microsecond=0)), (daily, parked.date())):
+            entry = totals[(item['lot_id'], bucket)]
+            entry[0] += 1
+            entry[1] += item['cost'] or 0.0
+            entry[2] += item['duration_hours'] or 0.0
+    _upsert(LotHourlyRollup, hourly)
+    _upsert(LotDailyRollup, daily)
+
+
+def delete_lot_rollups(lot_id):
+    """Drop a deleted lot's rollups (its reservations go with it)."""
+    for model in (LotHourlyRollup, LotDailyRollup):
+        db.session.execute(delete(model).where(model.lot_id == lot_id))
+
+
+def rebuild_rollups(lot_id=None, since=None, until=None, conn=None):
+    """Recompute rollups from reservations for whole days in [since, until).
+
+    Returns the number of daily buckets written. Runs in the caller's
+    transaction, or on `conn` when given (migrations).
+    """
+    executor = conn if conn is not None else db.session
+    if since is not None:
+        since = datetime.combine(since.date(), datetime.min.time())
+    if until is not None and until.time() != datetime.min.time():
+        until = datetime.combine(until.date(), datetime.min.time()) + timedelta(days=1)
+
+    criteria = ["leaving_timestamp IS NOT NULL"]
+    params = {}
+    if lot_id is not None:
+        criteria.append("parking_lot_id = :lot_id")
+        params['lot_id'] = lot_id
+    if since is not None:
+        criteria.append("parking_timestamp >= :since")
+        params['since'] = str(since)
+    if until is not None:
+        criteria.append("parking_timestamp < :until")
+        params['until'] = str(until)
+    where = ' AND '.join(criteria)
+
+    written = 0
+    for model, bucket_sql in ((LotHourlyRollup, _HOUR_SQL), (LotDailyRollup, _DAY_SQL)):
+        stale = delete(model)
+        if lot_id is not None:
+            stale = stale.where(model.lot_id == lot_id)
+        if since is not None:
+            stale = stale.where(model.bucket >= (since if model is LotHourlyRollup else since.date()))
+        if until is not None:
+            stale = stale.where(model.bucket < (until if model is LotHourlyRollup else until.date()))
+        executor.execute(stale)
+        result = executor.execute(text(
+            f"INSERT INTO {model.__tablename__} (lot_id, bucket, completed, revenue, occupied_hours) "
+            f"SELECT parking_lot_id, {bucket_sql}, COUNT(*), COALESCE(SUM(parking_cost), 0), "
+            f"SUM((julianday(leaving_timestamp) - julianday(parking_timestamp)) * 24) "
+            f"FROM reservations WHERE {where} GROUP BY parking_lot_id, {bucket_sql}"
+        ), params)
+        written = result.rowcount
+    return written
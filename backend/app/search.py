@@ -0,0 +1,66 @@
+import re
+from sqlalchemy import text
+
+# Full-text search over lots and users with SQLite FTS5.
+#
+# lots_fts and users_fts are external-content indexes over parking_lots and
+# users, kept in sync by triggers (created in migrations.py) that only fire
+# when an indexed column changes, so counter updates on those rows cost
+# nothing extra. Each word of the query is matched as a prefix and results
+# come back ranked by bm25, best first.
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+FTS_TABLES = {
+    'lots_fts': ('parking_lots', ['prime_location_name', 'address', 'pin_code']),
+    'users_fts': ('users', ['username', 'email', 'phone_number', 'first_name', 'last_name']),
+}
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_table_sql(name):
+    """DDL for an FTS table and the triggers that keep it in sync with its content table."""
+    table, columns = FTS_TABLES[name]
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+        f"{cols}, content='{table}', content_rowid='id', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {name}({name}) VALUES ('rebuild')",
+    ]
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = _WORD.findall(query)
+    return ' '.join(f'"{word}"*' for word in words) if words else None
+
+
+def search_limit(value):
+    try:
+        limit = int(value) if value is not None else DEFAULT_SEARCH_LIMIT
+    except (TypeError, ValueError):
+        raise ValueError('limit must be a number')
+    return min(max(limit, 1), MAX_SEARCH_LIMIT)
+
+
+def search_ids(session, name, query, limit):
+    """Ids of the best matching rows of the FTS table's content table, best first."""
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    rows = session.execute(
+        text(f"SELECT rowid FROM {name} WHERE {name} MATCH :q ORDER BY rank LIMIT :limit"),
+        {'q': expression, 'limit': limit}
+    )
+    return [row[0] for row in rows]
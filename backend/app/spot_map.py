@@ -0,0 +1,54 @@
+from itertools import groupby
+from .models import db, ParkingSpot
+
+# Compact spot maps for large lots (?format=compact on the lot detail views).
+#
+# Instead of one object per spot, each floor is a run-length string of spot
+# statuses over its spot numbers, e.g. "120A3O1H76A", with '-' for numbers
+# that have no spot on that floor. Spot ids are almost always consecutive
+# with spot numbers (spots are created in batches), so they are sent as
+# [first_spot_number, first_id, count] runs: id = first_id + (number -
+# first_spot_number). A 10,000-spot lot encodes to a few hundred bytes.
+
+GAP = '-'
+
+
+def _rle(symbols):
+    return ''.join(f'{len(list(run))}{symbol}' for symbol, run in groupby(symbols))
+
+
+def compact_spot_map(lot_id):
+    rows = db.session.query(
+        ParkingSpot.spot_number, ParkingSpot.id, ParkingSpot.status, ParkingSpot.floor
+    ).filter(ParkingSpot.lot_id == lot_id).order_by(ParkingSpot.spot_number).all()
+
+    by_floor = {}
+    id_runs = []
+    counts = {}
+    for number, spot_id, status, floor in rows:
+        by_floor.setdefault(floor or 1, []).append((number, status))
+        counts[status] = counts.get(status, 0) + 1
+        run = id_runs[-1] if id_runs else None
+        if run and number - run[0] == run[2] and spot_id - run[1] == run[2]:
+            run[2] += 1
+        else:
+            id_runs.append([number, spot_id, 1])
+
+    floors = []
+    for floor, spots in sorted(by_floor.items()):
+        first, last = spots[0][0], spots[-1][0]
+        symbols = [GAP] * (last - first + 1)
+        for number, status in spots:
+            symbols[number - first] = status
+        floors.append({
+            'floor': floor,
+            'first_spot': first,
+            'last_spot': last,
+            'spots': len(spots),
+            'runs': _rle(symbols)
+        })
+    return {'encoding': 'rle', 'counts': counts, 'floors': floors, 'ids': id_runs}
+
+
+def wants_compact(request):
+    return request.args.get('format') == 'compact'
@@ -0,0 +1,53 @@
+from .models import db, ParkingLot, ParkingSpot
+
+# Delta sync of lot spot maps.
+#
+# Triggers (migration 10) bump parking_lots.spot_version on every spot insert,
+# status/floor change or delete, and stamp the changed spot with the new
+# version. A client holding the map at version V asks for the spots with
+# version > V and patches its copy. Removed spots leave nothing behind to
+# report, so a client from before spot_reset_version (or one too far behind
+# for a delta to be worth it) gets a full snapshot instead.
+
+MAX_DELTA_SPOTS = 1000
+
+
+def spot_dict(spot):
+    return {
+        'id': spot.id,
+        'spot_number': spot.spot_number,
+        'status': spot.status,
+        'is_occupied': spot.is_occupied,
+        'is_available': spot.status == 'A'
+    }
+
+
+def spot_changes(lot_id, since):
+    """Spots of the lot changed after version `since`.
+
+    Returns None for an unknown lot, else a dict with the lot's current
+    version, its free spot count, whether it is a full snapshot, and the spots.
+    """
+    lot = db.session.query(
+        ParkingLot.spot_version, ParkingLot.spot_reset_version,
+        ParkingLot.number_of_spots, ParkingLot.occupied
+    ).filter(ParkingLot.id == lot_id).first()
+    if lot is None:
+        return None
+    version, reset_version, number_of_spots, occupied = lot
+    query = ParkingSpot.query.filter(ParkingSpot.lot_id == lot_id)
+    full = since is None or since < reset_version or since > version
+    if not full:
+        # One past the limit tells us whether a delta is still worth sending
+        spots = query.filter(ParkingSpot.version > since, ParkingSpot.version <= version).order_by(
+            ParkingSpot.spot_number
+        ).limit(MAX_DELTA_SPOTS + 1).all()
+        full = len(spots) > MAX_DELTA_SPOTS
+    if full:
+        spots = query.order_by(ParkingSpot.spot_number).all()
+    return {
+        'version': version,
+        'available_spots': max((number_of_spots or 0) - (occupied or 0), 0),
+        'full': full,
+        'spots': [spot_dict(spot) for spot in spots]
+    }
@@ -0,0 +1,53 @@
+import csv
+import io
+import json
+from flask import Response, stream_with_context
+
+# Streamed exports for listings too large to build as one JSON document.
+# Clients pick the format with the Accept header; plain JSON stays the default.
+
+NDJSON = 'application/x-ndjson'
+CSV = 'text/csv'
+
+
+def stream_format(request):
+    """Return NDJSON, CSV or None (regular JSON) for the request's Accept header."""
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON, CSV])
+    return best if best in (NDJSON, CSV) else None
+
+
+def _ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def _csv_lines(records, columns):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    # Send the header straight away so the download starts immediately
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for record in records:
+        writer.writerow(record)
+        # Flush roughly every 64KB instead of per row
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_records(records, fmt, columns, filename):
+    """Stream an iterable of dicts as NDJSON or CSV."""
+    if fmt == CSV:
+        body = _csv_lines(records, columns)
+    else:
+        body = _ndjson_lines(records)
+    response = Response(stream_with_context(body), mimetype=fmt)
+    if fmt == CSV:
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
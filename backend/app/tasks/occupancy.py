@@ -0,0 +1,27 @@
+from app import create_app
+from app.occupancy import reconcile_occupied
+from app.view_cache import invalidate_lot_views
+from celery import shared_task
+
+# Built once per worker process, without the web-only startup work (a full
+# parking_spots scan for the allocators, the lot grid, the hold expiry thread)
+_app = None
+
+
+def _task_app():
+    global _app
+    if _app is None:
+        _app = create_app({'WARM_WEB_STATE': False})
+    return _app
+
+
+@shared_task
+def reconcile_lot_occupancy():
+    app = _task_app()
+    with app.app_context():
+        drifted = reconcile_occupied()
+        for lot_id, (counter, actual) in drifted.items():
+            print(f"[OCCUPANCY] Lot {lot_id} counter drifted: {counter} -> {actual}")
+        if drifted:
+            invalidate_lot_views(*drifted)
+        return f"Repaired occupancy for {len(drifted)} lots."
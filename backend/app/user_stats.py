@@ -0,0 +1,104 @@
+from collections import defaultdict
+from sqlalchemy import delete, func, text
+from sqlalchemy.dialects.sqlite import insert
+from .models import db, Reservation, UserStats, UserMonthlyStats
+
+# Per-user statistics projection behind the user summary and analytics
+# endpoints. Completed reservations are added to the user's totals and to the
+# month they were parked in during checkout, so the dashboards read one row
+# plus one row per month instead of the user's whole history. Open
+# reservations are counted live through the partial index on active rows.
+
+
+def _upsert(model, keys, totals):
+    if not totals:
+        return
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[getattr(model, key) for key in keys],
+        set_={
+            'completed': model.completed + stmt.excluded.completed,
+            'cost': model.cost + stmt.excluded.cost,
+            'hours': model.hours + stmt.excluded.hours,
+        }
+    )
+    db.session.execute(stmt, [
+        dict(zip(keys, key if isinstance(key, tuple) else (key,)), completed=completed, cost=cost, hours=hours)
+        for key, (completed, cost, hours) in totals.items()
+    ])
+
+
+def record_user_completions(items):
+    """Add completed reservations to their users' statistics in the caller's transaction.
+
+    Items are dicts with user_id, parking_timestamp, duration_hours and cost.
+    """
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    monthly = defaultdict(lambda: [0, 0.0, 0.0])
+    for item in items:
+        for entry in (totals[item['user_id']], monthly[(item['user_id'], item['parking_timestamp'].strftime('%Y-%m'))]):
+            entry[0] += 1
+            entry[1] += item['cost'] or 0.0
+            entry[2] += item['duration_hours'] or 0.0
+    _upsert(UserStats, ('user_id',), totals)
+    _upsert(UserMonthlyStats, ('user_id', 'month'), monthly)
+
+
+REBUILD_CHUNK_SIZE = 500
+
+
+def rebuild_user_stats(user_ids=None, conn=None):
+    """Recompute the projection from reservations for the given users (all when None)."""
+    if user_ids is None:
+        _rebuild(None, conn)
+        return
+    user_ids = sorted(set(user_ids))
+    # Keep each statement well under SQLite's bound parameter limit
+    for i in range(0, len(user_ids), REBUILD_CHUNK_SIZE):
+        _rebuild(user_ids[i:i + REBUILD_CHUNK_SIZE], conn)
+
+
+def _rebuild(user_ids, conn):
+    executor = conn if conn is not None else db.session
+    where = "leaving_timestamp IS NOT NULL"
+    params = {}
+    if user_ids is not None:
+        where += f" AND user_id IN ({', '.join(f':u{i}' for i in range(len(user_ids)))})"
+        params = {f'u{i}': user_id for i, user_id in enumerate(user_ids)}
+    for model in (UserStats, UserMonthlyStats):
+        stale = delete(model)
+        if user_ids is not None:
+            stale = stale.where(model.user_id.in_(user_ids))
+        executor.execute(stale)
+    hours = "(julianday(leaving_timestamp) - julianday(parking_timestamp)) * 24"
+    executor.execute(text(
+        f"INSERT INTO user_stats (user_id, completed, cost, hours) "
+        f"SELECT user_id, COUNT(*), COALESCE(SUM(parking_cost), 0), SUM({hours}) "
+        f"FROM reservations WHERE {where} GROUP BY user_id"
+    ), params)
+    executor.execute(text(
+        f"INSERT INTO user_monthly_stats (user_id, month, completed, cost, hours) "
+        f"SELECT user_id, strftime('%Y-%m', parking_timestamp), COUNT(*), COALESCE(SUM(parking_cost), 0), SUM({hours}) "
+        f"FROM reservations WHERE {where} GROUP BY user_id, strftime('%Y-%m', parking_timestamp)"
+    ), params)
+
+
+def user_statistics(user_id):
+    """Totals, per-month completed buckets and active reservations by month for a user."""
+    stats = db.session.get(UserStats, user_id)
+    months = UserMonthlyStats.query.filter_by(user_id=user_id).order_by(UserMonthlyStats.month).all()
+    month = func.strftime('%Y-%m', Reservation.parking_timestamp)
+    active_by_month = dict(db.session.query(month, func.count(Reservation.id)).filter(
+        Reservation.user_id == user_id, Reservation.leaving_timestamp.is_(None)
+    ).group_by(month).all())
+    completed = stats.completed if stats else 0
+    active = sum(active_by_month.values())
+    return {
+        'completed': completed,
+        'active': active,
+        'total': completed + active,
+        'cost': stats.cost if stats else 0.0,
+        'hours': stats.hours if stats else 0.0,
+        'months': months,
+        'active_by_month': active_by_month,
+    }
@@ -0,0 +1,235 @@
+from collections import OrderedDict
+from functools import wraps
+import os
+import threading
+import time
+import uuid
+from flask import current_app, make_response, request
+from flask_caching.backends.base import BaseCache
+from . import cache
+
+# Response caching for the hot read views.
+#
+# The backend is chosen with CACHE_BACKEND: 'lru' (default) is an in-process
+# LRU with per-entry TTLs, 'redis' shares one cache between all workers (and
+# the Celery processes that invalidate it), 'null' disables caching.
+#
+# Each cached view entry records the version of every tag it depends on
+# ('lots' for the lot list, 'lot:3' for lot 3's details). Invalidating a tag just writes a new version
+# token, so every entry built on the old version stops counting as fresh at
+# once - in every worker sharing the backend - without anyone having to
+# enumerate keys.
+#
+# Entries outlive their freshness by STALE_SECONDS. When an entry is stale
+# (expired or invalidated) one request takes a short rebuild lock and
+# recomputes it while concurrent requests keep serving the previous response,
+# so a booking burst or an expiry at peak costs one rebuild, not one per
+# request. Requests that find no entry at all wait briefly for the builder.
+
+CACHE_BACKENDS = {
+    'lru': 'app.view_cache.LRUCache',
+    'redis': 'RedisCache',
+    'null': 'NullCache',
+}
+VIEW_TIMEOUT = 60
+STALE_SECONDS = 300
+REBUILD_LOCK_SECONDS = 10
+COLD_WAIT_SECONDS = 2.0
+COLD_POLL_SECONDS = 0.05
+
+
+class LRUCache(BaseCache):
+    """Thread-safe in-process cache holding at most `threshold` entries.
+
+    Values are stored by reference, so callers must not mutate them.
+    """
+
+    def __init__(self, threshold=2048, default_timeout=300):
+        super().__init__(default_timeout=default_timeout)
+        self.threshold = threshold
+        self._entries = OrderedDict()  # key -> (expires_at or 0, value)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        return cls(threshold=config['CACHE_THRESHOLD'], default_timeout=kwargs['default_timeout'])
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.monotonic() + timeout if timeout > 0 else 0
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] and entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+        return entry[1] if entry else None
+
+    def _store(self, key, value, timeout):
+        self._entries[key] = (self._expiry(timeout), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.threshold:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._store(key, value, timeout)
+        return True
+
+    def add(self, key, value, timeout=None):
+        # Atomic, so it can serve as a lock between threads
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._store(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def has(self, key):
+        with self._lock:
+            return self._live(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'coalesced': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """Hit/miss counters of this process and the backend in use."""
+    with _stats_lock:
+        stats = dict(_stats)
+    served = stats['hits'] + stats['stale'] + stats['coalesced']
+    lookups = served + stats['misses']
+    backend = cache.cache
+    stats.update({
+        'backend': type(backend).__name__,
+        'pid': os.getpid(),
+        'hit_ratio': round(served / lookups, 4) if lookups else None,
+    })
+    if isinstance(backend, LRUCache):
+        stats.update({'size': len(backend), 'threshold': backend.threshold})
+    return stats
+
+
+def _tag_key(tag):
+    return f'tag:{tag}'
+
+
+def tag_versions(tags):
+    """Current version token of each tag, creating tokens for unseen tags."""
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(*keys)
+    for i, version in enumerate(versions):
+        if version is None:
+            # A fresh random token, so entries from before an evicted version
+            # key can never match again; add() keeps a racing worker's token
+            token = uuid.uuid4().hex[:12]
+            cache.add(keys[i], token, timeout=0)
+            versions[i] = cache.get(keys[i]) or token
+    return versions
+
+
+def invalidate_tags(*tags):
+    for tag in tags:
+        cache.set(_tag_key(tag), uuid.uuid4().hex[:12], timeout=0)
+
+
+def _respond(entry):
+    _, _, body, status, mimetype = entry
+    return current_app.response_class(body, status=status, mimetype=mimetype)
+
+
+def _build(view, args, kwargs, entry_key, lock_key, versions, timeout):
+    response = make_response(view(*args, **kwargs))
+    try:
+        if response.status_code == 200:
+            entry = (versions, time.time(), response.get_data(), response.status_code, response.mimetype)
+            cache.set(entry_key, entry, timeout=timeout + STALE_SECONDS)
+        cache.delete(lock_key)
+    except Exception as e:
+        # The lock times out on its own if it cannot be released here
+        _count('errors')
+        print(f"[CACHE][ERROR] Store failed: {e}")
+    return response
+
+
+def cached_view(key, tags=(), timeout=VIEW_TIMEOUT, query_args=()):
+    """Cache a view's successful responses under `key` and `tags`.
+
+    Both are format strings filled from the view arguments, e.g.
+    cached_view('user_lot_{lot_id}', tags=('lot:{lot_id}',)).
+    Query parameters named in `query_args` become part of the key.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                versions = '.'.join(tag_versions([tag.format(**kwargs) for tag in tags]))
+                entry_key = f'view:{key.format(**kwargs)}'
+                for name in query_args:
+                    entry_key += f'|{name}={request.args.get(name, "")}'
+                lock_key = f'rebuild:{entry_key}'
+                entry = cache.get(entry_key)
+                if entry is not None and entry[0] == versions and time.time() - entry[1] < timeout:
+                    _count('hits')
+                    return _respond(entry)
+                building = cache.add(lock_key, os.getpid(), timeout=REBUILD_LOCK_SECONDS)
+                if not building:
+                    # Someone else is rebuilding: serve what we have, or wait for it
+                    if entry is not None:
+                        _count('stale')
+                        return _respond(entry)
+                    deadline = time.monotonic() + COLD_WAIT_SECONDS
+                    while time.monotonic() < deadline:
+                        time.sleep(COLD_POLL_SECONDS)
+                        entry = cache.get(entry_key)
+                        if entry is not None:
+                            _count('coalesced')
+                            return _respond(entry)
+                        if not cache.has(lock_key):
+                            break
+            except Exception as e:
+                # A cache outage must not take the views down with it
+                _count('errors')
+                print(f"[CACHE][ERROR] Lookup failed: {e}")
+                return view(*args, **kwargs)
+            _count('misses')
+            if building:
+                return _build(view, args, kwargs, entry_key, lock_key, versions, timeout)
+            # The builder failed or is slow; compute this one ourselves
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def invalidate_lot_views(*lot_ids):
+    """Drop the cached lot list and the detail views of the given lots."""
+    try:
+        invalidate_tags('lots', *(f'lot:{lot_id}' for lot_id in lot_ids))
+    except Exception as e:
+        _count('errors')
+        print(f"[CACHE][ERROR] Invalidation failed: {e}")
@@ -0,0 +1,89 @@
+"""Concurrent booking benchmark.
+
+Fires many parallel reservations at a single parking lot through the real
+reserve endpoint and reports throughput and double allocations.
+
+    python benchmarks/concurrent_booking.py --spots 5000 --bookings 4000 --threads 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func
+from app import create_app
+from app.models import db, User, ParkingLot, ParkingSpot, Reservation
+from app.provisioning import add_spots
+
+
+def setup(app, spots, users):
+    with app.app_context():
+        lot = ParkingLot(prime_location_name='Benchmark Lot', price=20, address='Bench',
+                         pin_code='000000', number_of_spots=spots)
+        db.session.add(lot)
+        db.session.flush()
+        add_spots(lot.id, 1, spots, spots)
+        tokens = []
+        for i in range(users):
+            user = User(first_name='Bench', last_name=str(i), username=f'bench{i}',
+                        email=f'bench{i}@example.com', phone_number='0000000000', role='user')
+            user.set_password('bench')
+            db.session.add(user)
+            db.session.flush()
+            tokens.append(create_access_token(identity=f'{user.id}:user'))
+        db.session.commit()
+        return lot.id, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spots', type=int, default=5000)
+    parser.add_argument('--bookings', type=int, default=4000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 60}},
+        'OCCUPANCY_SAMPLE_SECONDS': 0,
+    })
+    lot_id, tokens = setup(app, args.spots, args.users)
+    client = app.test_client()
+
+    def book(i):
+        headers = {'Authorization': f'Bearer {tokens[i % len(tokens)]}'}
+        response = client.post(f'/api/user/parking-lots/{lot_id}/reserve',
+                               json={'vehicle_number': f'BENCH{i:06d}'}, headers=headers)
+        return response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        statuses = list(pool.map(book, range(args.bookings)))
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        double_allocated = db.session.query(Reservation.spot_id).filter(
+            Reservation.leaving_timestamp.is_(None)
+        ).group_by(Reservation.spot_id).having(func.count(Reservation.id) > 1).count()
+        occupied = ParkingSpot.query.filter_by(lot_id=lot_id, status='O').count()
+
+    booked = statuses.count(201)
+    print(f"bookings attempted : {args.bookings} ({args.threads} threads, {args.spots} spots)")
+    print(f"bookings succeeded : {booked}")
+    print(f"bookings rejected  : {statuses.count(400)}")
+    print(f"server errors      : {sum(1 for s in statuses if s >= 500)}")
+    print(f"elapsed            : {elapsed:.2f}s")
+    print(f"bookings/sec       : {booked / elapsed:.1f}")
+    print(f"occupied spots     : {occupied}")
+    print(f"double allocations : {double_allocated}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def redis_workers(tmp_path):
+    """Two apps on one database sharing a fake Redis cache, like two web workers."""
+    fakeredis = pytest.importorskip('fakeredis')
+    from app import create_app
+
+    server = fakeredis.FakeServer()
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'workers.db'),
+        'CACHE_TYPE': 'RedisCache',
+        'CACHE_REDIS_URL': None,
+        'OCCUPANCY_SAMPLE_SECONDS': 0,
+    }
+    return [
+        create_app(dict(config, CACHE_REDIS_HOST=fakeredis.FakeStrictRedis(server=server)))
+        for _ in range(2)
+    ]
+
+
+@pytest.fixture
+def worker_headers(redis_workers):
+    """Authorization headers of the admin and of a fresh driver account."""
+    from flask_jwt_extended import create_access_token
+    from app.models import db, User
+
+    with redis_workers[0].app_context():
+        user = User(first_name='A', last_name='B', username='driver', email='driver@example.com',
+                    phone_number='1', role='user')
+        user.set_password('x')
+        db.session.add(user)
+        db.session.commit()
+        admin = User.query.filter_by(role='admin').first()
+        return (
+            {'Authorization': 'Bearer ' + create_access_token(identity=f'{admin.id}:admin')},
+            {'Authorization': 'Bearer ' + create_access_token(identity=f'{user.id}:user')},
+        )
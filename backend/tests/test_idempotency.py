@@ -0,0 +1,37 @@
+from app import cache
+from app.idempotency import store
+from app.models import db
+
+
+def test_retry_on_another_worker_is_replayed(redis_workers, worker_headers):
+    first, second = redis_workers
+    admin, user = worker_headers
+    first.test_client().post('/api/admin/parking-lots', headers=admin, json={
+        'prime_location_name': 'Lot', 'price': 10, 'address': 'Street', 'pin_code': '1', 'number_of_spots': 5
+    })
+    headers = dict(user, **{'Idempotency-Key': 'booking-1'})
+    body = {'vehicle_number': 'KA01AB1234'}
+
+    booked = first.test_client().post('/api/user/parking-lots/1/reserve', json=body, headers=headers)
+    retried = second.test_client().post('/api/user/parking-lots/1/reserve', json=body, headers=headers)
+
+    assert booked.status_code == 201
+    assert retried.status_code == 201
+    assert retried.headers.get('Idempotent-Replayed') == 'true'
+    assert retried.json['reservation']['id'] == booked.json['reservation']['id']
+    with second.app_context():
+        assert db.session.execute(db.text("SELECT count(*) FROM reservations")).scalar() == 1
+
+
+def test_in_flight_key_is_claimed_once(redis_workers):
+    first, second = redis_workers
+    key = ('1:user', 'POST', '/api/user/parking-lots/1/reserve', 'booking-2')
+    with first.app_context():
+        assert store.begin(key, 'body') is None
+        # The marker lives in Redis, not in this process
+        assert cache.cache._read_client.keys('parking:idem:*')
+    with second.app_context():
+        assert store.begin(key, 'body') == ('body', None)
+        store.complete(key, 'body', (b'{}', 201, 'application/json'))
+    with first.app_context():
+        assert store.begin(key, 'body') == ('body', (b'{}', 201, 'application/json'))
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app import create_app
+from app.migrations import check_query_plans, current_version, upgrade, MIGRATIONS
+from app.models import db
+
+# Tables as the app created them before versioned migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY, first_name VARCHAR(50) NOT NULL, last_name VARCHAR(50) NOT NULL,
+    age INTEGER, username VARCHAR(80) NOT NULL UNIQUE, email VARCHAR(120) NOT NULL UNIQUE,
+    phone_number VARCHAR(20) NOT NULL, address VARCHAR(255), password_hash VARCHAR(128) NOT NULL,
+    role VARCHAR(10) NOT NULL, flagged BOOLEAN, created_at DATETIME
+);
+CREATE TABLE parking_lots (
+    id INTEGER PRIMARY KEY, prime_location_name VARCHAR(100) NOT NULL, price FLOAT NOT NULL,
+    address VARCHAR(200) NOT NULL, pin_code VARCHAR(10) NOT NULL, number_of_spots INTEGER NOT NULL,
+    occupied INTEGER, created_at DATETIME
+);
+CREATE TABLE parking_spots (
+    id INTEGER PRIMARY KEY, lot_id INTEGER NOT NULL REFERENCES parking_lots (id),
+    spot_number INTEGER NOT NULL, status VARCHAR(1) NOT NULL, is_occupied BOOLEAN, floor INTEGER,
+    current_reservation_id INTEGER REFERENCES reservations (id), created_at DATETIME,
+    CONSTRAINT unique_spot_per_lot UNIQUE (lot_id, spot_number)
+);
+CREATE TABLE reservations (
+    id INTEGER PRIMARY KEY, spot_id INTEGER NOT NULL REFERENCES parking_spots (id),
+    user_id INTEGER NOT NULL REFERENCES users (id), parking_lot_id INTEGER NOT NULL REFERENCES parking_lots (id),
+    parking_timestamp DATETIME NOT NULL, leaving_timestamp DATETIME, parking_cost FLOAT, status VARCHAR(20),
+    vehicle_number VARCHAR(20) NOT NULL, phone_number VARCHAR(20), customer_name VARCHAR(100), remarks VARCHAR(200)
+);
+INSERT INTO users (id, first_name, last_name, username, email, phone_number, password_hash, role)
+    VALUES (1, 'A', 'B', 'driver', 'driver@example.com', '1', 'x', 'user');
+INSERT INTO parking_lots (id, prime_location_name, price, address, pin_code, number_of_spots, occupied)
+    VALUES (1, 'Lot', 10, 'Street', '1', 2, 1);
+INSERT INTO parking_spots (id, lot_id, spot_number, status, is_occupied, floor)
+    VALUES (1, 1, 1, 'O', 1, 1), (2, 1, 2, 'A', 0, 1);
+INSERT INTO reservations (id, spot_id, user_id, parking_lot_id, parking_timestamp, leaving_timestamp, parking_cost, status, vehicle_number)
+    VALUES (1, 2, 1, 1, '2025-01-01 10:00:00', '2025-01-01 12:00:00', 20, 'Completed', 'KA01'),
+           (2, 1, 1, 1, '2025-01-02 10:00:00', NULL, NULL, 'Active', 'KA02');
+"""
+
+
+def _app(path):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(path),
+        'WARM_WEB_STATE': False,
+    })
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    app = _app(tmp_path / 'plans.db')
+    with app.app_context():
+        # create_app already migrated; a second run must be a no-op
+        assert upgrade() == []
+        assert current_version() == MIGRATIONS[-1][0]
+        assert check_query_plans() == {}
+
+
+def test_dropped_index_is_reported(tmp_path):
+    app = _app(tmp_path / 'plans.db')
+    with app.app_context():
+        # Both leave the planner walking some other reservations index
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_reservations_user_parking"))
+            conn.execute(text("DROP INDEX ix_reservations_vehicle_leaving"))
+        failures = check_query_plans()
+    assert {'user reservations by time', 'user history page', 'active reservation by vehicle'} <= set(failures)
+
+
+def test_baseline_database_is_upgraded(tmp_path):
+    path = tmp_path / 'baseline.db'
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+    app = _app(path)
+    with app.app_context():
+        assert current_version() == MIGRATIONS[-1][0]
+        assert check_query_plans() == {}
+        with db.engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM reservations")).scalar() == 2
+            assert conn.execute(text("SELECT sum(completed) FROM lot_rollups_daily")).scalar() == 1
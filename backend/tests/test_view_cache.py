@@ -0,0 +1,40 @@
+from app import cache
+from app.view_cache import cache_stats
+
+
+def _available(app, headers):
+    response = app.test_client().get('/api/user/parking-lots', headers=headers)
+    assert response.status_code == 200
+    return [lot['available_spots'] for lot in response.json['lots']]
+
+
+def test_tag_bump_stale_serve_and_refresh(redis_workers, worker_headers):
+    first, second = redis_workers
+    admin, user = worker_headers
+    first.test_client().post('/api/admin/parking-lots', headers=admin, json={
+        'prime_location_name': 'Lot', 'price': 10, 'address': 'Street', 'pin_code': '1', 'number_of_spots': 5
+    })
+
+    # Built on one worker, served from Redis on the other
+    assert _available(first, user) == [5]
+    hits = cache_stats()['hits']
+    assert _available(second, user) == [5]
+    assert cache_stats()['hits'] == hits + 1
+
+    # A booking on the second worker bumps the 'lots' tag for both
+    booked = second.test_client().post('/api/user/parking-lots/1/reserve',
+                                       json={'vehicle_number': 'KA01AB1234'}, headers=user)
+    assert booked.status_code == 201
+
+    # While another worker holds the rebuild lock, the old entry is served
+    with second.app_context():
+        assert cache.add('rebuild:view:user_lots', 'other', timeout=10)
+    stale = cache_stats()['stale']
+    assert _available(first, user) == [5]
+    assert cache_stats()['stale'] == stale + 1
+
+    # Once the lock is gone the next request rebuilds, and both workers see it
+    with second.app_context():
+        cache.delete('rebuild:view:user_lots')
+    assert _available(first, user) == [4]
+    assert _available(second, user) == [4]
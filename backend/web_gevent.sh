@@ -0,0 +1,7 @@
+#!/bin/bash
+# Production web server. Lot event streams (SSE) hold their connection open,
+# so each one needs its own worker thread; gevent workers run them as
+# greenlets instead, and one worker holds thousands of listeners. With more
+# than one worker, set EVENTS_BACKEND=redis so events reach every worker and
+# CACHE_BACKEND=redis so cached views and Idempotency-Keys are shared.
+gunicorn -k gevent -w ${WEB_WORKERS:-1} --worker-connections ${WEB_CONNECTIONS:-2000} -b 0.0.0.0:5000 'app:create_app()'
@@ -67,6 +67,13 @@ export default {
         });
     },
 
+    // Server-Sent Events stream; EventSource cannot send headers, so the
+    // token goes in the query string
+    events(resource) {
+        const token = localStorage.getItem('token');
+        return new EventSource(`${API.defaults.baseURL}${resource}?jwt=${encodeURIComponent(token)}`);
+    },
+
     logout() {
         localStorage.removeItem('token');
         localStorage.removeItem('role');